@@ -0,0 +1,638 @@
+#!/usr/bin/env python3
+"""Micro-benchmarks for the hyprtheme engine.
+
+    python bench.py palette [--rounds N]
+    python bench.py importtime [--budget-ms MS]
+    python bench.py engine [--sizes 10,100,1000,5000] [--baseline FILE [--save-baseline]]
+    python bench.py check [NAME ...]
+
+`engine` runs against a throwaway HOME holding a synthetic theme library;
+hyprctl, swww, gsettings, dconf, pkill... are replaced by stubs that only
+log their arguments, so nothing on the real desktop is touched. `check`
+runs behaviour checks against fakes (e.g. a Hyprland socket) and exits
+non-zero if any fails.
+"""
+import argparse
+import json
+import os
+import shutil
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+sys.path.append(os.path.dirname(__file__))
+
+import engine
+
+APP_DIR = Path(__file__).resolve().parent
+BUNDLED_THEMES = APP_DIR.parent / "themes"
+
+# Commands the engine may shell out to; replaced by logging stubs in the sandbox
+STUB_COMMANDS = ("hyprctl", "swww", "swww-daemon", "gsettings", "dconf", "pkill", "pgrep",
+                 "ghostty", "waybar", "notify-send")
+STUB_MONITORS = [{"name": "DP-1", "width": 2560, "height": 1440, "transform": 0}]
+WALLPAPER_SIZE = (3840, 2160)
+GHOSTTY_DEPTH, GHOSTTY_FANOUT = 4, 3
+HEAVY_THEMES = 2  # themes with a deep ghostty tree and their own large wallpaper
+
+# Must never be pulled in by a bare `import engine`
+HEAVY_MODULES = ("gi", "PIL", "numpy", "colorthief", "concurrent.futures", "subprocess")
+
+
+def _timeit(fn, rounds):
+    samples = []
+    result = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return result, samples
+
+
+def _summary(samples):
+    samples = sorted(samples)
+    return {
+        "p50_ms": round(statistics.median(samples), 3),
+        "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3),
+    }
+
+
+def _hex(colors):
+    return ["#{:02x}{:02x}{:02x}".format(*c) for c in colors]
+
+
+def _color_distance(a, b):
+    """Mean distance from each color in a to its nearest color in b."""
+    return statistics.mean(
+        min(sum((x - y) ** 2 for x, y in zip(ca, cb)) ** 0.5 for cb in b) for ca in a
+    )
+
+
+def bench_palette(rounds):
+    report = {}
+    for wp in _bundled_wallpapers():
+        im = engine._load_thumbnail(wp)
+        row = {}
+        engine.palette_numpy(im)  # warm-up: numpy import
+        np_colors, samples = _timeit(lambda: engine.palette_numpy(im), rounds)
+        row["numpy"] = _summary(samples) | {"palette": _hex(np_colors)}
+        try:
+            ct_colors, samples = _timeit(lambda: engine.palette_colorthief(im), rounds)
+            row["colorthief"] = _summary(samples) | {"palette": _hex(ct_colors)}
+            row["mean_color_distance"] = round(_color_distance(np_colors, ct_colors), 2)
+        except ImportError:
+            row["colorthief"] = None
+        report[wp.parent.name] = row
+    return report
+
+
+def _bundled_wallpapers():
+    out = []
+    for tj in sorted(BUNDLED_THEMES.glob("*/theme.json")):
+        rel = json.loads(tj.read_text(encoding="utf-8")).get("wallpaper", "")
+        if rel and (tj.parent / rel).exists():
+            out.append(tj.parent / rel)
+    return out
+
+
+def bench_importtime(rounds):
+    """Cumulative `import engine` time (us) per run, and any heavy modules it loaded."""
+    totals, heavy = [], set()
+    for _ in range(rounds):
+        res = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import engine"],
+            cwd=APP_DIR, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, check=True
+        )
+        for line in res.stderr.splitlines():
+            parts = [p.strip() for p in line.split("|")]
+            if len(parts) != 3 or not parts[1].isdigit():
+                continue
+            name = parts[2]
+            if name == "engine":
+                totals.append(int(parts[1]))
+            elif name in HEAVY_MODULES:
+                heavy.add(name)
+    return totals, sorted(heavy)
+
+
+# ---------- engine benchmark (sandboxed) ----------
+
+def _write_stubs(bindir: Path, log: Path):
+    bindir.mkdir(parents=True, exist_ok=True)
+    monitors = json.dumps(STUB_MONITORS)
+    for name in STUB_COMMANDS:
+        stub = bindir / name
+        stub.write_text(
+            "#!/bin/sh\n"
+            f"echo \"{name} $*\" >> '{log}'\n"
+            f"case \"$*\" in *monitors*) echo '{monitors}';; esac\n",
+            encoding="utf-8",
+        )
+        stub.chmod(0o755)
+
+
+def _write_wallpaper(path: Path, seed: int, size=WALLPAPER_SIZE):
+    """A binary PPM gradient, distinct per seed so palettes aren't shared."""
+    w, h = size
+    base = bytearray(w * 3)
+    base[0::3] = bytes((x * 255 // w + seed * 37) & 255 for x in range(w))
+    base[1::3] = bytes((x * 7 + seed * 11) & 255 for x in range(w))
+    with open(path, "wb") as f:
+        f.write(f"P6\n{w} {h}\n255\n".encode("ascii"))
+        for y in range(h):
+            base[2::3] = bytes([(y * 255 // h) & 255]) * w
+            f.write(base)
+
+
+def _write_ghostty_tree(root: Path, depth: int, fanout: int):
+    root.mkdir(parents=True, exist_ok=True)
+    (root / "config").write_text("theme = synthetic\nfont-size = 12\n", encoding="utf-8")
+    (root / "colors.conf").write_text("".join(f"palette = {i}=#{i * 9:06x}\n" for i in range(16)),
+                                      encoding="utf-8")
+    if depth:
+        for i in range(fanout):
+            _write_ghostty_tree(root / f"d{i}", depth - 1, fanout)
+
+
+def make_library(themes_dir: Path, count: int):
+    """Synthetic themes; the first HEAVY_THEMES get deep ghostty trees and big wallpapers."""
+    themes_dir.mkdir(parents=True, exist_ok=True)
+    shared_wp = themes_dir / ".shared-wallpaper.ppm"
+    _write_wallpaper(shared_wp, 0, size=(64, 36))
+    for i in range(count):
+        tdir = themes_dir / f"theme-{i:05d}"
+        tdir.mkdir()
+        (tdir / "hyprland.conf").write_text(
+            f"general {{\n    gaps_in = {i % 8}\n    col.active_border = rgba({i % 256:02x}88ccff)\n}}\n",
+            encoding="utf-8")
+        (tdir / "waybar.css").write_text(f"@define-color accent #{(i * 2654435761) & 0xffffff:06x};\n",
+                                         encoding="utf-8")
+        if i < HEAVY_THEMES:
+            _write_wallpaper(tdir / "wallpaper.ppm", i + 1)
+            _write_ghostty_tree(tdir / "ghostty", GHOSTTY_DEPTH, GHOSTTY_FANOUT)
+        else:
+            os.link(shared_wp, tdir / "wallpaper.ppm")
+            _write_ghostty_tree(tdir / "ghostty", 0, 0)
+        (tdir / "theme.json").write_text(json.dumps({
+            "name": f"Synthetic {i}",
+            "wallpaper": "wallpaper.ppm",
+            "gtk_theme": f"Synthetic-{i % 3}",
+            "gtk_icon_theme": "Papirus-Dark",
+            "gtk_cursor_theme": f"Cursor-{i % 2}",
+            "adw_color_scheme": "prefer-dark",
+        }), encoding="utf-8")
+
+
+def _fake_swww_daemon(runtime: Path):
+    """Listen where swww-daemon would, so swww_ensure() sees a running daemon."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(str(runtime / "wayland-0-swww-daemon.socket"))
+    sock.listen(64)
+
+    def accept():
+        while True:
+            try:
+                sock.accept()[0].close()
+            except OSError:
+                return
+    threading.Thread(target=accept, daemon=True).start()
+    return sock
+
+
+def bench_engine(sizes, rounds, keep=False):
+    report = {}
+    for size in sizes:
+        root = Path(tempfile.mkdtemp(prefix=f"hyprtheme-bench-{size}-"))
+        try:
+            home, runtime, bindir, log = root / "home", root / "run", root / "bin", root / "calls.log"
+            runtime.mkdir(mode=0o700, parents=True)
+            _write_stubs(bindir, log)
+            make_library(home / ".config" / "hyprtheme" / "themes", size)
+            env = {k: v for k, v in os.environ.items()
+                   if k not in ("HYPRLAND_INSTANCE_SIGNATURE", "DBUS_SESSION_BUS_ADDRESS", "HYPRTHEME_TRACE")}
+            env.update(HOME=str(home), XDG_CONFIG_HOME=str(home / ".config"), XDG_RUNTIME_DIR=str(runtime),
+                       WAYLAND_DISPLAY="wayland-0", GSETTINGS_BACKEND="memory",
+                       PATH=f"{bindir}{os.pathsep}{os.environ.get('PATH', '')}")
+            out = root / "result.json"
+            sock = _fake_swww_daemon(runtime)
+            try:
+                subprocess.run([sys.executable, __file__, "_engine-child", "--rounds", str(rounds),
+                                "--out", str(out)],
+                               env=env, cwd=APP_DIR, check=True,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+            except subprocess.CalledProcessError as e:
+                raise RuntimeError(f"benchmark child failed for {size} themes:\n{e.stderr}") from None
+            finally:
+                sock.close()
+            row = json.loads(out.read_text(encoding="utf-8"))
+            calls = {}
+            if log.exists():
+                for line in log.read_text(encoding="utf-8").splitlines():
+                    cmd = line.split(" ", 1)[0]
+                    calls[cmd] = calls.get(cmd, 0) + 1
+            row["stub_calls"] = calls
+            report[str(size)] = row
+        finally:
+            if keep:
+                print(f"[bench] kept sandbox {root}", file=sys.stderr)
+            else:
+                shutil.rmtree(root, ignore_errors=True)
+    return report
+
+
+# Short-lived engine threads an apply may leave running. Long-lived workers
+# (apply queue, snapshot writer) never exit, so they're drained instead.
+ENGINE_BACKGROUND_THREADS = ("palette-css", "state-flush", "prestage-", "wallpaper-prescale")
+
+
+def _settle():
+    """Wait for the background work an apply started: palette CSS, state flush, snapshot writes."""
+    for th in threading.enumerate():
+        if th.name.startswith(ENGINE_BACKGROUND_THREADS):
+            th.join(timeout=30)
+    engine.flush_snapshots()
+
+
+def _cold_reset():
+    """Drop the engine's in-memory and on-disk caches and the applied config files."""
+    engine.flush_state()
+    for attr in ("_THEME_CACHE_SIG", "_THEME_CACHE", "_THEME_ENTRIES", "_FP_INDEX", "_PALETTE_CACHE", "_STATE"):
+        setattr(engine, attr, None)
+    engine._SWWW_UP = False
+    for path in (engine.FP_INDEX_FILE, engine.PALETTE_CACHE_FILE, engine.THEME_INDEX_FILE, engine.STATE_FILE,
+                 engine.HYPR_CONF, engine.WAYBAR_THEME):
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+    for tree in (engine.WALLPAPER_CACHE_DIR, engine.GHOSTTY_DIR):
+        shutil.rmtree(tree, ignore_errors=True)
+
+
+def engine_child(rounds):
+    """Runs inside the sandbox (HOME already points at it)."""
+    if not str(engine.HOME).startswith(tempfile.gettempdir()):
+        raise SystemExit(f"refusing to benchmark outside a sandbox HOME: {engine.HOME}")
+    engine.RUNTIME_CSS_FILE = engine.STATE_DIR / "style-vars.css"  # not the app's own copy
+    heavy = [f"theme-{i:05d}" for i in range(HEAVY_THEMES)]
+    row = {}
+
+    engine.list_themes()
+    _, samples = _timeit(engine._themes_signature, rounds)
+    row["themes_signature"] = _summary(samples)
+
+    def list_cold():
+        engine._THEME_CACHE_SIG = engine._THEME_CACHE = engine._THEME_ENTRIES = None
+        return engine.list_themes()
+    themes, samples = _timeit(list_cold, rounds)
+    row["list_themes_cold"] = _summary(samples) | {"themes": len(themes)}
+    _, samples = _timeit(engine.list_themes, rounds)
+    row["list_themes_warm"] = _summary(samples)
+
+    src = engine.THEME_ROOT / heavy[0] / "ghostty"
+    scratch = engine.STATE_DIR / "bench-copy"
+    samples = []
+    for _ in range(rounds):
+        shutil.rmtree(scratch, ignore_errors=True)
+        start = time.perf_counter()
+        engine.copy_tree_fast(src, scratch)
+        samples.append((time.perf_counter() - start) * 1000)
+    row["copy_tree_fast_cold"] = _summary(samples) | {"files": sum(1 for p in src.rglob("*") if p.is_file())}
+    _, samples = _timeit(lambda: engine.copy_tree_fast(src, scratch), rounds)
+    row["copy_tree_fast_warm"] = _summary(samples)
+    shutil.rmtree(scratch, ignore_errors=True)
+
+    samples = []
+    for i in range(rounds):
+        _cold_reset()
+        start = time.perf_counter()
+        engine.apply_theme(heavy[i % 2])
+        samples.append((time.perf_counter() - start) * 1000)
+        _settle()
+    row["apply_theme_cold"] = _summary(samples)
+
+    engine.apply_theme(heavy[0])
+    _settle()
+    samples = []
+    for i in range(rounds):
+        # Alternate so every apply really changes files, wallpaper and settings
+        start = time.perf_counter()
+        engine.apply_theme(heavy[(i + 1) % 2])
+        samples.append((time.perf_counter() - start) * 1000)
+        _settle()
+    row["apply_theme_warm"] = _summary(samples)
+    return row
+
+
+def compare_baseline(report, baseline, tolerance, floor_ms=1.0):
+    """Regressions: p50 slower than baseline by more than tolerance (and floor_ms)."""
+    regressions = []
+    for size, row in report.items():
+        for metric, cur in row.items():
+            base = baseline.get(size, {}).get(metric)
+            if not isinstance(cur, dict) or not isinstance(base, dict) or "p50_ms" not in base:
+                continue
+            ratio = cur["p50_ms"] / base["p50_ms"] if base["p50_ms"] else 1.0
+            cur["vs_baseline"] = round(ratio, 3)
+            if ratio > 1 + tolerance and cur["p50_ms"] - base["p50_ms"] > floor_ms:
+                regressions.append(f"{size} themes: {metric} p50 {base['p50_ms']} -> {cur['p50_ms']} ms")
+    return regressions
+
+
+# ---------- checks (against fakes, no desktop needed) ----------
+
+def _expect(failures, what, got, want):
+    if got != want:
+        failures.append(f"{what}: got {got!r}, want {want!r}")
+
+
+@contextmanager
+def _environ(**values):
+    """Set (None: unset) environment variables for the block."""
+    saved = {k: os.environ.get(k) for k in values}
+    for k, v in values.items():
+        if v is None:
+            os.environ.pop(k, None)
+        else:
+            os.environ[k] = v
+    try:
+        yield
+    finally:
+        for k, v in saved.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
+
+
+def _fake_hyprland(runtime: Path, sig: str, replies=None):
+    """Serve Hyprland's request socket for instance `sig`; returns (socket, requests seen).
+
+    Each command is answered "ok" (one per command of a [[BATCH]]) unless
+    replies maps the request to another answer.
+    """
+    path = runtime / "hypr" / sig / ".socket.sock"
+    path.parent.mkdir(parents=True)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(str(path))
+    sock.listen(16)
+    seen = []
+
+    def answer(request):
+        if replies and request in replies:
+            return replies[request]
+        if request.startswith("[[BATCH]]"):
+            return "\n\n".join("ok" for _ in request[len("[[BATCH]]"):].split(";"))
+        return "ok"
+
+    def serve():
+        while True:
+            try:
+                conn = sock.accept()[0]
+            except OSError:
+                return
+            with conn:
+                request = conn.recv(65536).decode("utf-8")
+                seen.append(request)
+                conn.sendall(answer(request).encode("utf-8"))
+    threading.Thread(target=serve, daemon=True).start()
+    return sock, seen
+
+
+def check_hypr_ipc():
+    """hyprctl()/hypr_request() framing and replies on a fake Hyprland socket."""
+    failures = []
+    with tempfile.TemporaryDirectory(prefix="hyprtheme-check-") as tmp, \
+            _environ(XDG_RUNTIME_DIR=tmp, HYPRLAND_INSTANCE_SIGNATURE="check"):
+        sock, seen = _fake_hyprland(Path(tmp), "check", replies={"dispatch bogus": "Invalid dispatcher"})
+        try:
+            _expect(failures, "single command", engine.hyprctl("reload"), "ok")
+            _expect(failures, "single request", seen[-1:], ["reload"])
+            out = engine.hyprctl("setcursor Bibata 24", "", "reload")
+            _expect(failures, "batched request", seen[-1], "[[BATCH]]setcursor Bibata 24;reload")
+            _expect(failures, "batched reply", out.split(), ["ok", "ok"])
+            _expect(failures, "error reply", engine.hyprctl("dispatch bogus"), "Invalid dispatcher")
+            _expect(failures, "nothing to send", (engine.hyprctl("", ""), len(seen)), ("", 3))
+        finally:
+            sock.shutdown(socket.SHUT_RDWR)  # wakes the accept() so the socket really closes
+            sock.close()
+        _expect(failures, "socket not answering", engine.hypr_request("reload", timeout=0.5), None)
+    with _environ(HYPRLAND_INSTANCE_SIGNATURE=None):
+        _expect(failures, "no Hyprland instance", engine.hypr_request("reload"), None)
+    return failures
+
+
+def _plan_problems(old, new):
+    """Ways hypr_keyword_plan(old, new) disagrees with parsing new directly."""
+    plan = engine.hypr_keyword_plan(old, new)
+    if plan is None:
+        return []
+    old_kw, _ = engine.parse_hypr_conf(old)
+    new_kw, _ = engine.parse_hypr_conf(new)
+    sent = dict(cmd[len("keyword "):].split(" ", 1) for cmd in plan)
+    want = {k: v for k, v in new_kw.items() if old_kw.get(k) != v}
+    return [] if sent == want else [f"plan {plan!r} but changed options are {want!r}"]
+
+
+def check_hypr_parser():
+    """parse_hypr_conf()/hypr_keyword_plan() on the bundled configs and edits of them."""
+    failures = []
+    confs = {tj.parent.name: (tj.parent / "hyprland.conf").read_text(encoding="utf-8")
+             for tj in sorted(BUNDLED_THEMES.glob("*/theme.json")) if (tj.parent / "hyprland.conf").is_file()}
+    _expect(failures, "bundled configs", {"nord", "gruvbox"} <= confs.keys(), True)
+    for name, text in confs.items():
+        keywords, lists = engine.parse_hypr_conf(text)
+        _expect(failures, f"{name}: unknown syntax", lists.get("?"), None)
+        _expect(failures, f"{name}: banner comments", [k for k in keywords if k.startswith("#")], [])
+        _expect(failures, f"{name}: nested section", "decoration:blur:enabled" in keywords, True)
+        _expect(failures, f"{name}: binds are lists", any(k.startswith("bind") for k in lists), True)
+        _expect(failures, f"{name}: against itself", engine.hypr_keyword_plan(text, text), [])
+        _expect(failures, f"{name}: comments only",
+                engine.hypr_keyword_plan(text, "# a comment\n\n" + text + "\n#####\n"), [])
+        edits = {
+            "option": ("general {\n    gaps_in = 17\n}\n", ["keyword general:gaps_in 17"]),
+            "nested option": ("decoration {\n  blur {\n    size = 9\n  }\n}\n",
+                              ["keyword decoration:blur:size 9"]),
+            "new option": ("misc {\n    vfr = true\n}\n", ["keyword misc:vfr true"]),
+            "bind": ("bind = SUPER, X, exec, true\n", None),
+            "device": ("device {\n    name = check\n    sensitivity = 1\n}\n", None),
+            "value with ;": ("general {\n    layout = a;b\n}\n", None),
+        }
+        for what, (extra, want) in edits.items():
+            _expect(failures, f"{name}: {what}", engine.hypr_keyword_plan(text, text + extra), want)
+        _expect(failures, f"{name}: removed option",
+                engine.hypr_keyword_plan(text + edits["new option"][0], text), None)
+    for a in confs:
+        for b in confs:
+            failures += [f"{a} -> {b}: {p}" for p in _plan_problems(confs[a], confs[b])]
+
+    syntax = "$gap = 4\ngeneral {\n    gaps_in = $gap  # inline\n    col.x = a##b\n}\n"
+    _expect(failures, "variables and ##", engine.parse_hypr_conf(syntax)[0],
+            {"general:gaps_in": "4", "general:col.x": "a#b"})
+    _expect(failures, "variable change", engine.hypr_keyword_plan(syntax, syntax.replace("= 4", "= 6")),
+            ["keyword general:gaps_in 6"])
+    return failures
+
+
+def check_hypr_reload():
+    """hypr_reload() sends keywords, nothing, or a full reload, on a fake Hyprland socket."""
+    failures = []
+    old = "general {\n    gaps_in = 3\n    gaps_out = 6\n}\nbind = SUPER, Q, killactive\n"
+    saved_conf = engine.HYPR_CONF
+    with tempfile.TemporaryDirectory(prefix="hyprtheme-check-") as tmp, \
+            _environ(XDG_RUNTIME_DIR=tmp, HYPRLAND_INSTANCE_SIGNATURE="check"):
+        autoreload = '{"option": "misc:disable_autoreload", "int": 0, "set": false}'
+        sock, seen = _fake_hyprland(Path(tmp), "check", replies={
+            "j/getoption misc:disable_autoreload": autoreload,
+            "keyword general:gaps_out 99": "bad value",
+        })
+        engine.HYPR_CONF = Path(tmp) / "hyprland.conf"
+        try:
+            def reload_with(new):
+                engine.HYPR_CONF.write_text(new, encoding="utf-8")
+                del seen[:]
+                engine.hypr_reload(old)
+                return [r for r in seen if not r.startswith("j/getoption")]
+
+            _expect(failures, "unchanged", reload_with(old + "# comment\n"), [])
+            _expect(failures, "one option", reload_with(old.replace("= 3", "= 5")),
+                    ["keyword general:gaps_in 5"])
+            _expect(failures, "two options", reload_with(old.replace("= 3", "= 5").replace("= 6", "= 7")),
+                    ["[[BATCH]]keyword general:gaps_in 5;keyword general:gaps_out 7"])
+            _expect(failures, "rejected keyword", reload_with(old.replace("= 6", "= 99")),
+                    ["keyword general:gaps_out 99", "reload"])
+            _expect(failures, "list changed", reload_with(old.replace("killactive", "exit")), ["reload"])
+            _expect(failures, "autoreload looked up", engine._hypr_autoreload(), True)
+        finally:
+            engine.HYPR_CONF = saved_conf
+            sock.shutdown(socket.SHUT_RDWR)
+            sock.close()
+    return failures
+
+
+def check_processes():
+    """find_pids()/signal_process() against throwaway child processes."""
+    failures = []
+    sleep = shutil.which("sleep")
+    name = "hyprtheme-probe"  # comm is the executable's name; argv[0] stays "sleep"
+    own_comm = engine._proc_comm(os.getpid())
+    with tempfile.TemporaryDirectory(prefix="hyprtheme-check-") as tmp:
+        probe = Path(tmp) / name
+        probe.symlink_to(sleep)
+
+        def spawn(*argv):
+            proc = subprocess.Popen(list(argv) or ["sleep", "30"], executable=None if argv else str(probe))
+            deadline = time.monotonic() + 5
+            while engine._proc_comm(proc.pid) == own_comm and time.monotonic() < deadline:
+                time.sleep(0.005)  # Popen may return before the child has exec'd
+            return proc
+
+        children = []
+        try:
+            a = spawn()
+            children.append(a)
+            _expect(failures, "discovered", engine.find_pids(name), [a.pid])
+            b = spawn()
+            children.append(b)
+            _expect(failures, "instance started later", sorted(engine.find_pids(name)),
+                    sorted([a.pid, b.pid]))
+            a.kill()
+            a.wait()
+            _expect(failures, "dead PID dropped", engine.find_pids(name), [b.pid])
+            # The same PID running another program is what a reused PID looks like to a scan
+            c = spawn("sh", "-c", f'sleep 0.3; exec "{probe}" 30')
+            children.append(c)
+            _expect(failures, "PID running something else", c.pid in engine.find_pids(name), False)
+            time.sleep(0.6)
+            _expect(failures, "PID now running the probe", c.pid in engine.find_pids(name), True)
+            _expect(failures, "signalled", engine.signal_process(name, signal.SIGUSR2), 2)
+            _expect(failures, "delivered", [p.wait(timeout=5) for p in (b, c)], [-signal.SIGUSR2] * 2)
+            _expect(failures, "none left", (engine.find_pids(name), engine.signal_process(name, 0)), ([], 0))
+        finally:
+            for p in children:
+                if p.poll() is None:
+                    p.kill()
+                    p.wait()
+    return failures
+
+
+CHECKS = {
+    "hypr-ipc": check_hypr_ipc,
+    "hypr-parser": check_hypr_parser,
+    "hypr-reload": check_hypr_reload,
+    "processes": check_processes,
+}
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("palette", help="NumPy extractor vs ColorThief on the bundled wallpapers")
+    p.add_argument("--rounds", type=int, default=5)
+    p = sub.add_parser("importtime", help="check `import engine` against a time budget")
+    p.add_argument("--rounds", type=int, default=5)
+    p.add_argument("--budget-ms", type=float, default=50.0)
+    p = sub.add_parser("engine", help="signature/list/copy/apply timings on synthetic libraries")
+    p.add_argument("--sizes", default="10,100,1000,5000", help="comma-separated theme counts")
+    p.add_argument("--rounds", type=int, default=5)
+    p.add_argument("--baseline", type=Path, help="JSON report to compare against")
+    p.add_argument("--save-baseline", action="store_true", help="write this run to --baseline")
+    p.add_argument("--tolerance", type=float, default=0.25, help="allowed p50 slowdown (0.25 = 25%%)")
+    p.add_argument("--keep", action="store_true", help="keep the sandbox directories")
+    p = sub.add_parser("check", help="behaviour checks against fakes; non-zero exit on failure")
+    p.add_argument("names", nargs="*", metavar="NAME",
+                   help=f"checks to run (default: all of {', '.join(CHECKS)})")
+    p = sub.add_parser("_engine-child")
+    p.add_argument("--rounds", type=int, default=5)
+    p.add_argument("--out", type=Path, required=True)
+    args = ap.parse_args(argv)
+
+    if args.cmd == "palette":
+        print(json.dumps(bench_palette(args.rounds), indent=2))
+    elif args.cmd == "importtime":
+        totals, heavy = bench_importtime(args.rounds)
+        best_ms = min(totals) / 1000
+        print(json.dumps({"best_ms": best_ms, "budget_ms": args.budget_ms, "heavy_modules": heavy}))
+        if heavy or best_ms > args.budget_ms:
+            print("[importtime] over budget or heavy module imported", file=sys.stderr)
+            return 1
+    elif args.cmd == "engine":
+        sizes = [int(n) for n in args.sizes.split(",") if n.strip()]
+        report = bench_engine(sizes, args.rounds, keep=args.keep)
+        regressions = []
+        if args.baseline and args.save_baseline:
+            args.baseline.write_text(json.dumps(report, indent=2) + "\n", encoding="utf-8")
+        elif args.baseline:
+            regressions = compare_baseline(report, json.loads(args.baseline.read_text(encoding="utf-8")),
+                                           args.tolerance)
+        print(json.dumps(report, indent=2))
+        for r in regressions:
+            print(f"[engine] regression: {r}", file=sys.stderr)
+        return 1 if regressions else 0
+    elif args.cmd == "check":
+        unknown = [n for n in args.names if n not in CHECKS]
+        if unknown:
+            ap.error(f"unknown check(s): {', '.join(unknown)}")
+        failed = 0
+        for name in args.names or CHECKS:
+            failures = CHECKS[name]()
+            print(f"[check] {name}: {'FAILED' if failures else 'ok'}")
+            for f in failures:
+                print(f"    {f}")
+            failed += bool(failures)
+        return 1 if failed else 0
+    elif args.cmd == "_engine-child":
+        row = engine_child(args.rounds)
+        args.out.write_text(json.dumps(row), encoding="utf-8")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
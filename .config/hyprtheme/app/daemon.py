@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""Resident hyprtheme engine behind a UNIX socket.
+
+    python engine.py daemon          # start the server
+    python daemon.py apply <id>      # client: apply <id> | prestage <id> | next | prev | status
+
+The protocol is one text line per request ("apply nord") answered by one
+JSON line ({"ok": true, ...}); applies first stream {"event": "stage", ...}
+progress lines. Applies go through the engine's queue, so a newer request
+cancels an older one ({"ok": false, "cancelled": true}). The client part
+only imports the stdlib so a keybind pays for little more than the
+interpreter start.
+"""
+import json
+import os
+import socket
+import sys
+import time
+
+
+def socket_path() -> str:
+    runtime = os.environ.get("XDG_RUNTIME_DIR", "")
+    if runtime:
+        return os.path.join(runtime, "hyprtheme.sock")
+    return f"/tmp/hyprtheme-{os.getuid()}.sock"
+
+
+# ---------- client ----------
+
+def request(*words: str, timeout: float = 30.0, on_event=None) -> dict | None:
+    """Send one request to the daemon; None if no daemon is listening.
+
+    Progress events before the reply are passed to on_event(event). Once
+    connected, the daemon may be mid-apply, so a timeout, dropped connection
+    or garbled reply comes back as {"ok": False, "error": ...}, never None:
+    callers must not redo the request in-process.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.settimeout(timeout)
+        try:
+            s.connect(socket_path())
+        except OSError:
+            return None
+        try:
+            s.sendall((" ".join(words) + "\n").encode("utf-8"))
+            with s.makefile("rb") as f:
+                while True:
+                    line = f.readline()
+                    if not line:
+                        return {"ok": False, "error": "daemon closed the connection without replying"}
+                    reply = json.loads(line)
+                    if "event" not in reply:
+                        return reply
+                    if on_event is not None:
+                        on_event(reply)
+        except (OSError, ValueError) as e:
+            return {"ok": False, "error": f"daemon: {e}"}
+
+
+# ---------- server ----------
+
+def _handle(eng, started: float, line: str, emit=None) -> dict:
+    words = line.split(None, 1)
+    cmd = words[0] if words else ""
+    arg = words[1].strip() if len(words) > 1 else ""
+
+    if (cmd == "apply" and arg) or cmd in ("next", "prev"):
+        # next/prev step from the theme already queued, so quick repeats each advance
+        step = {"next": 1, "prev": -1}.get(cmd, 0)
+
+        def progress(tid, stage, finished, total):
+            if emit is not None:
+                emit({"event": "stage", "theme": tid, "stage": stage, "done": finished, "total": total})
+        try:
+            theme, summary = eng.apply_theme_queued(arg, progress=progress, step=step)
+        except eng.ApplyCancelled as e:
+            return {"ok": False, "theme": e.theme_id or arg, "cancelled": True, "error": str(e)}
+        return {"ok": True, "theme": theme, "summary": summary}
+    if cmd == "prestage" and arg:
+        return {"ok": True, "theme": arg, "started": eng.prestage(arg) is not None}
+    if cmd == "status":
+        return {
+            "ok": True,
+            "theme": eng.current_theme(),
+            "turbo": eng.get_turbo(),
+            "themes": len(eng.list_themes()),
+            "uptime": round(time.monotonic() - started, 1),
+            "pid": os.getpid(),
+        }
+    return {"ok": False, "error": f"unknown request: {line!r}"}
+
+
+def serve(eng=None):
+    """Run the daemon until interrupted, keeping the engine and its caches warm."""
+    import signal
+    import socketserver
+    import threading
+
+    if eng is None:
+        import engine as eng
+
+    path = socket_path()
+    if request("status", timeout=1.0) is not None:
+        print(f"[daemon] already running on {path}")
+        return 1
+    try:
+        os.unlink(path)  # stale socket from a previous run
+    except FileNotFoundError:
+        pass
+
+    started = time.monotonic()
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            line = self.rfile.readline().decode("utf-8", "replace").strip()
+
+            def emit(msg):
+                try:
+                    self.wfile.write((json.dumps(msg) + "\n").encode("utf-8"))
+                except OSError:
+                    pass  # client went away; the apply carries on
+            # Applies serialize (and supersede each other) in the engine's queue
+            try:
+                reply = _handle(eng, started, line, emit)
+            except Exception as e:
+                reply = {"ok": False, "error": str(e)}
+            emit(reply)
+
+    # Warm-up: theme index, state and Gio settings before the first request
+    eng.list_themes()
+    eng.get_turbo()
+    eng.warm_up()
+
+    server = socketserver.ThreadingUnixStreamServer(path, Handler)
+    server.daemon_threads = True
+    os.chmod(path, 0o600)
+    # SIGTERM (systemd, pkill) shuts down cleanly so the socket gets removed
+    signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=server.shutdown).start())
+    print(f"[daemon] listening on {path}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+    return 0
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if (not argv or argv[0] not in ("apply", "prestage", "next", "prev", "status")
+            or (argv[0] in ("apply", "prestage") and len(argv) < 2)):
+        print("usage: daemon.py apply <id> | prestage <id> | next | prev | status", file=sys.stderr)
+        return 2
+
+    reply = request(*argv)
+    if reply is None and argv[0] == "prestage":
+        # Caches warmed in this short-lived process would go with it
+        print(json.dumps({"ok": False, "error": "no daemon running"}))
+        return 1
+    if reply is None:
+        # No daemon: do the work in-process
+        sys.path.append(os.path.dirname(__file__))
+        import engine
+        return engine.main(argv)
+
+    print(json.dumps(reply))
+    return 0 if reply.get("ok") else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,27 +1,51 @@
+import atexit
 import json
-import shutil
-import subprocess
+import sys
 import time
 import os
 import hashlib
+import stat
 import threading
+from contextlib import contextmanager
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor
 
-# Optional: Gio for fast, in-process gsettings
-try:
-    import gi
-    gi.require_version("Gio", "2.0")
-    from gi.repository import Gio  # type: ignore
-    _HAVE_GIO = True
-except Exception:
-    _HAVE_GIO = False
+# Heavy/optional modules (gi, PIL, numpy, colorthief, concurrent.futures,
+# subprocess, shutil) are imported where they're used so `engine.py list`
+# and the exec-once restore start fast. Keep it that way: bench.py importtime.
 
 HOME = Path.home()
 CONFIG = HOME / ".config"
 THEME_ROOT = CONFIG / "hyprtheme" / "themes"
 STATE_DIR = CONFIG / "hyprtheme"
 STATE_FILE = STATE_DIR / "state.json"
+FP_INDEX_FILE = STATE_DIR / "fingerprints.json"
+PALETTE_CACHE_FILE = STATE_DIR / "palettes.json"
+THEME_INDEX_FILE = STATE_DIR / "themes.index.json"
+TRACE_SUMMARY_FILE = STATE_DIR / "trace-summary.json"
+TRACE_KEEP = 20
+THEME_INDEX_VERSION = 4
+
+# Pre-apply snapshots: blobs/<sha256> shared by all snapshots, one <id>.json manifest each
+SNAPSHOT_DIR = STATE_DIR / "snapshots"
+SNAPSHOT_KEEP = 30
+
+# Content-addressed store: objects/<sha256[:2]>/<sha256[2:]>, hardlinked into themes
+STORE_DIR = STATE_DIR / "store"
+STORE_OBJECTS = STORE_DIR / "objects"
+
+# Rendered template outputs, named by a hash of template + variables
+RENDER_DIR = STATE_DIR / "rendered"
+RENDER_KEEP = 64
+
+# Generations mode: each theme is materialized once under GEN_ROOT; live config
+# files are symlinks through GEN_CURRENT, itself a symlink swapped atomically.
+GEN_ROOT = STATE_DIR / "generations"
+GEN_CURRENT = STATE_DIR / "current"
+GEN_KEEP = 8
+
+# Wallpapers pre-scaled per output size, as uncompressed PPM (cheapest to decode)
+WALLPAPER_CACHE_DIR = STATE_DIR / "wallpapers"
+WALLPAPER_CACHE_MAX_BYTES = 768 << 20
 
 HYPR_DIR = CONFIG / "hypr"
 HYPR_CONF = HYPR_DIR / "hyprland.conf"
@@ -33,16 +57,78 @@ GHOSTTY_DIR = CONFIG / "ghostty"
 GHOSTTY_CONFIG_DEFAULT = GHOSTTY_DIR / "config"
 
 APP_ID = "com.prono.HyprTheme"
+# Palette variables picked up by the app's stylesheet
+RUNTIME_CSS_FILE = Path(__file__).resolve().parent / "style-vars.css"
 
-# In-memory theme cache
+# In-memory theme cache; per-theme entries are {"stamp": [mtime_ns, size], "item": {...}}
 _THEME_CACHE_SIG = None
 _THEME_CACHE = None
+_THEME_ENTRIES = None
+_THEME_LOCK = threading.Lock()
 
 # Turbo flag (persisted in state)
 _TURBO = True
 
+# Process-wide state: loaded once, writes coalesced and flushed after a short debounce
+_STATE = None
+_STATE_MTIME = None
+_STATE_DIRTY = False
+_STATE_TIMER = None
+_STATE_LOCK = threading.Lock()
+STATE_FLUSH_DELAY = 0.3
+
+# swww-daemon known to be answering on its socket (cached for the process lifetime)
+_SWWW_UP = False
+
+# Scaled wallpapers being rendered in this process, one lock per destination
+_SCALING = {}
+_SCALING_LOCK = threading.Lock()
+
+# Spans of the apply being traced (None when not tracing)
+_TRACE = None
+_TRACE_T0 = 0.0
+_TRACE_LOCK = threading.Lock()
+
+# In-flight speculative prestage: (theme_id, cancel event, thread) or None
+_PRESTAGE = None
+_PRESTAGE_LOCK = threading.Lock()
+
+# Snapshot being recorded by the current apply, and the queue of its single FIFO writer thread
+_SNAP = None
+_SNAP_SEQ = 0
+_SNAP_LOCK = threading.Lock()
+_SNAP_QUEUE = None
+# Snapshots open or queued but not on disk yet: their blobs must survive a prune
+_SNAP_UNWRITTEN = []
+
+# Apply queue: at most one pending and one running job ({"id", "cancel", "progress", "done"})
+_QUEUE_COND = threading.Condition()
+_QUEUE_PENDING = None
+_QUEUE_RUNNING = None
+_QUEUE_WORKER = None
+
+# Reloads a cancelled apply still owes ({"hypr": config text Hyprland last loaded, "waybar": None})
+_OWED_RELOADS = {}
+
+# Logged once per process: Hyprland's config autoreload undoes keyword-only updates
+_HYPR_AUTORELOAD_WARNED = False
+
+# File fingerprint index: "dev:ino" -> [size, mtime_ns, sha256, last_used]
+_FP_INDEX = None
+_FP_DIRTY = False
+_FP_LOCK = threading.Lock()
+_FP_MAX_ENTRIES = 20000
+_FP_MAX_AGE = 30 * 86400
+
+# Palette cache: "v<PALETTE_VERSION>:<sha256 of wallpaper>" -> {"palette", "used"}
+PALETTE_VERSION = 3
+_PALETTE_CACHE = None
+_PALETTE_LOCK = threading.Lock()
+_PALETTE_MAX_ENTRIES = 256
+
 
 def sh(cmd, check=True):
+    import subprocess
     return subprocess.run(
         cmd, shell=True, check=check,
         stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
@@ -55,29 +141,101 @@ def _ensure_state_dir():
     STATE_DIR.mkdir(parents=True, exist_ok=True)
 
 
-def load_state() -> dict:
+def _write_json_atomic(path: Path, data: str):
+    import tempfile
+
+    _ensure_state_dir()
+    # A temp file per writer: the apply, palette-css and snapshot threads may save the same index
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
     try:
-        if STATE_FILE.exists():
-            return json.loads(STATE_FILE.read_text(encoding="utf-8"))
-    except Exception:
-        pass
-    return {}
+        os.fchmod(fd, 0o644)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
 
 
-def save_state(state: dict):
+def _state() -> dict:
+    """The shared state dict; reloaded if state.json changed on disk. Hold _STATE_LOCK."""
+    global _STATE, _STATE_MTIME
     try:
-        _ensure_state_dir()
-        STATE_FILE.write_text(json.dumps(state, indent=2), encoding="utf-8")
-    except Exception as e:
-        print(f"[state] failed to save: {e}")
+        mtime = STATE_FILE.stat().st_mtime_ns
+    except OSError:
+        mtime = None
+    if _STATE is None or (mtime != _STATE_MTIME and not _STATE_DIRTY):
+        try:
+            _STATE = json.loads(STATE_FILE.read_text(encoding="utf-8")) if mtime else {}
+        except Exception:
+            _STATE = {}
+        _STATE_MTIME = mtime
+    return _STATE
+
+
+def _schedule_state_flush():
+    """Hold _STATE_LOCK. Restart the debounce timer for the pending write."""
+    global _STATE_DIRTY, _STATE_TIMER
+    _STATE_DIRTY = True
+    if _STATE_TIMER is not None:
+        _STATE_TIMER.cancel()
+    _STATE_TIMER = threading.Timer(STATE_FLUSH_DELAY, flush_state)
+    _STATE_TIMER.daemon = True
+    _STATE_TIMER.name = "state-flush"
+    _STATE_TIMER.start()
+
+
+def flush_state():
+    """Write pending state changes now (temp file + rename)."""
+    global _STATE_DIRTY, _STATE_TIMER, _STATE_MTIME
+    with _STATE_LOCK:
+        if _STATE_TIMER is not None:
+            _STATE_TIMER.cancel()
+            _STATE_TIMER = None
+        if not _STATE_DIRTY:
+            return
+        try:
+            _write_json_atomic(STATE_FILE, json.dumps(_STATE, indent=2))
+            _STATE_MTIME = STATE_FILE.stat().st_mtime_ns
+            _STATE_DIRTY = False
+        except Exception as e:
+            print(f"[state] failed to save: {e}")
+
+
+atexit.register(flush_state)
+
+
+def load_state() -> dict:
+    with _STATE_LOCK:
+        return dict(_state())
+
+
+def save_state(state: dict):
+    with _STATE_LOCK:
+        current = _state()
+        if current == state:
+            return
+        current.clear()
+        current.update(state)
+        _schedule_state_flush()
+
+
+def update_state(**changes):
+    with _STATE_LOCK:
+        current = _state()
+        if all(current.get(k) == v for k, v in changes.items()):
+            return
+        current.update(changes)
+        _schedule_state_flush()
 
 
 def set_turbo(enabled: bool):
     global _TURBO
     _TURBO = bool(enabled)
-    st = load_state()
-    st["turbo"] = _TURBO
-    save_state(st)
+    update_state(turbo=_TURBO)
 
 
 def get_turbo() -> bool:
@@ -88,16 +246,332 @@ def get_turbo() -> bool:
     return _TURBO
 
 
+# ---------- tracing ----------
+
+@contextmanager
+def span(name: str, cat: str = "engine", **args):
+    """Time a block as a Chrome trace-event span; callers may add to the yielded args."""
+    if _TRACE is None:
+        yield args
+        return
+    start = time.perf_counter()
+    try:
+        yield args
+    finally:
+        end = time.perf_counter()
+        with _TRACE_LOCK:
+            if _TRACE is not None:
+                _TRACE.append({
+                    "name": name, "cat": cat, "ph": "X",
+                    "ts": round((start - _TRACE_T0) * 1e6, 1),
+                    "dur": round((end - start) * 1e6, 1),
+                    "pid": os.getpid(), "tid": threading.get_ident(),
+                    "args": {k: str(v) if isinstance(v, Path) else v for k, v in args.items()},
+                })
+
+
+def begin_trace():
+    global _TRACE, _TRACE_T0
+    with _TRACE_LOCK:
+        _TRACE = []
+        _TRACE_T0 = time.perf_counter()
+
+
+def end_trace(label: str) -> dict:
+    """Stop tracing; write the optional Chrome trace and the rolling summary.
+
+    The Chrome trace goes to $HYPRTHEME_TRACE if set (open it in Perfetto or
+    chrome://tracing). Returns this apply's summary.
+    """
+    global _TRACE
+    with _TRACE_LOCK:
+        events, _TRACE = _TRACE or [], None
+        total = (time.perf_counter() - _TRACE_T0) * 1000
+
+    stages = {e["name"]: round(e["dur"] / 1000, 2) for e in events if e["cat"] == "stage"}
+    files = {}
+    nbytes = 0
+    for e in events:
+        if e["cat"] == "file":
+            outcome = e["args"].get("outcome", "?")
+            files[outcome] = files.get(outcome, 0) + 1
+            nbytes += e["args"].get("bytes", 0)
+    summary = {
+        "label": label,
+        "time": int(time.time()),
+        "total_ms": round(total, 2),
+        "stages": stages,
+        "slowest": max(stages, key=stages.get) if stages else "",
+        "files": files,
+        "bytes": nbytes,
+    }
+
+    trace_path = os.environ.get("HYPRTHEME_TRACE", "")
+    if trace_path:
+        try:
+            Path(trace_path).write_text(json.dumps({"traceEvents": events, "displayTimeUnit": "ms"}),
+                                        encoding="utf-8")
+            print(f"[trace] wrote {trace_path}")
+        except Exception as e:
+            print(f"[trace] failed to write {trace_path}: {e}")
+    try:
+        history = json.loads(TRACE_SUMMARY_FILE.read_text(encoding="utf-8"))
+    except Exception:
+        history = []
+    history = (history + [summary])[-TRACE_KEEP:]
+    try:
+        _write_json_atomic(TRACE_SUMMARY_FILE, json.dumps(history, indent=1))
+    except Exception as e:
+        print(f"[trace] failed to write summary: {e}")
+    return summary
+
+
+def last_trace_summary() -> dict:
+    try:
+        return json.loads(TRACE_SUMMARY_FILE.read_text(encoding="utf-8"))[-1]
+    except Exception:
+        return {}
+
+
+# ---------- snapshots (pre-apply state, deduplicated) ----------
+
+def _snap_submit(fn, *args):
+    """Queue fn(*args) for the snapshot writer, a daemon thread started on first use."""
+    global _SNAP_QUEUE
+    with _SNAP_LOCK:
+        if _SNAP_QUEUE is None:
+            import queue
+            _SNAP_QUEUE = queue.Queue()
+            threading.Thread(target=_snap_writer, name="snapshot-writer", daemon=True).start()
+        _SNAP_QUEUE.put((fn, args))
+
+
+def _snap_writer():
+    while True:
+        fn, args = _SNAP_QUEUE.get()
+        try:
+            fn(*args)
+        except Exception as e:
+            print(f"[snapshot] {e}")
+        finally:
+            _SNAP_QUEUE.task_done()
+
+
+def flush_snapshots():
+    """Wait until queued snapshot blobs and manifests are written."""
+    if _SNAP_QUEUE is not None:
+        _SNAP_QUEUE.join()
+
+
+atexit.register(flush_snapshots)
+
+
+def begin_snapshot(label: str):
+    """Start recording the files an apply (or a rollback) is about to touch."""
+    global _SNAP
+    previous = current_theme()
+    with _SNAP_LOCK:
+        _SNAP = {"id": str(time.time_ns()), "label": label, "time": int(time.time()),
+                 "previous_theme": previous, "files": {}}
+        _SNAP_UNWRITTEN.append(_SNAP)
+
+
+def end_snapshot():
+    """Close the open snapshot; its manifest is written once its blobs are."""
+    global _SNAP
+    with _SNAP_LOCK:
+        snap, _SNAP = _SNAP, None
+        if snap and not snap["files"]:
+            _SNAP_UNWRITTEN.remove(snap)
+    if snap and snap["files"]:
+        _snap_submit(_write_snapshot, snap)
+
+
+def snapshot_file(path: Path):
+    """Record path as it is now in the open snapshot (first touch wins).
+
+    Nothing is recorded while no snapshot is open. Content whose blob is
+    already stored costs a stat; otherwise the file is cloned (a reflink
+    where the filesystem has them) and hashed into the blob store on the
+    snapshot writer.
+    """
+    global _SNAP_SEQ
+    path = Path(path)
+    with _SNAP_LOCK:
+        snap = _SNAP
+        if snap is None or str(path) in snap["files"]:
+            return
+        _SNAP_SEQ += 1
+        seq = _SNAP_SEQ
+    try:
+        if path.is_symlink():
+            entry = {"symlink": os.readlink(path)}
+        elif path.is_file():
+            st = os.stat(path)
+            entry = {"mode": stat.S_IMODE(st.st_mode)}
+            digest = _fp_lookup(st)
+            if digest and (SNAPSHOT_DIR / "blobs" / digest).exists():
+                entry["blob"] = digest
+            else:
+                # A copy, not a hardlink: the live inode may be shared with a theme and edited in place
+                pending = SNAPSHOT_DIR / "pending" / f"{snap['id']}-{seq}"
+                pending.parent.mkdir(parents=True, exist_ok=True)
+                clone_file(path, pending)
+                entry["pending"] = str(pending)
+                _snap_submit(_store_blob, entry, digest)
+        elif not path.exists():
+            entry = {"absent": True}
+        else:
+            return
+    except OSError as e:
+        print(f"[snapshot] {path}: {e}")
+        return
+    with _SNAP_LOCK:
+        snap["files"].setdefault(str(path), entry)
+
+
+def _store_blob(entry: dict, digest: str = ""):
+    pending = Path(entry.pop("pending"))
+    digest = digest or _hash_file(pending)
+    if not digest:
+        entry["error"] = "unreadable"
+        pending.unlink(missing_ok=True)
+        return
+    blob = SNAPSHOT_DIR / "blobs" / digest
+    if blob.exists():
+        pending.unlink()
+    else:
+        blob.parent.mkdir(parents=True, exist_ok=True)
+        os.chmod(pending, 0o444)
+        os.replace(pending, blob)
+    entry["blob"] = digest
+
+
+def _write_snapshot(snap: dict):
+    try:
+        SNAPSHOT_DIR.mkdir(parents=True, exist_ok=True)
+        with _SNAP_LOCK:
+            data = json.dumps(snap, indent=1)
+        _write_json_atomic(SNAPSHOT_DIR / f"{snap['id']}.json", data)
+        print(f"[snapshot] {snap['id']}: {len(snap['files'])} file(s) before {snap['label']}")
+    except Exception as e:
+        print(f"[snapshot] failed to write {snap['id']}: {e}")
+    finally:
+        with _SNAP_LOCK:
+            _SNAP_UNWRITTEN.remove(snap)
+    _prune_snapshots()
+    save_fingerprints()
+
+
+def list_snapshots() -> list:
+    """Snapshot manifests, newest first."""
+    out = []
+    try:
+        names = sorted((n for n in os.listdir(SNAPSHOT_DIR) if n.endswith(".json")), reverse=True)
+    except OSError:
+        return out
+    for name in names:
+        try:
+            out.append(json.loads((SNAPSHOT_DIR / name).read_text(encoding="utf-8")))
+        except Exception:
+            continue
+    return out
+
+
+def _prune_snapshots():
+    """Keep the newest SNAPSHOT_KEEP snapshots and the blobs they reference."""
+    snaps = list_snapshots()
+    for snap in snaps[SNAPSHOT_KEEP:]:
+        (SNAPSHOT_DIR / f"{snap['id']}.json").unlink(missing_ok=True)
+    with _SNAP_LOCK:
+        unwritten = [e for snap in _SNAP_UNWRITTEN for e in snap["files"].values()]
+    entries = unwritten + [e for snap in snaps[:SNAPSHOT_KEEP] for e in snap["files"].values()]
+    live = {e["blob"] for e in entries if "blob" in e}
+    try:
+        blobs = list(os.scandir(SNAPSHOT_DIR / "blobs"))
+    except OSError:
+        return
+    for entry in blobs:
+        if entry.name not in live:
+            os.unlink(entry.path)
+
+
+def _restore_entry(path: Path, entry: dict) -> bool:
+    if entry.get("absent"):
+        if path.is_symlink() or path.exists():
+            path.unlink()
+        return True
+    tmp = path.with_name(f".{path.name}.hyprtheme-tmp")
+    tmp.unlink(missing_ok=True)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if "symlink" in entry:
+        os.symlink(entry["symlink"], tmp)
+    elif "blob" in entry:
+        blob = SNAPSHOT_DIR / "blobs" / entry["blob"]
+        if file_checksum(blob) != entry["blob"]:  # damaged or removed since
+            print(f"[rollback] blob for {path} is missing or changed, skipped")
+            return False
+        clone_file(blob, tmp)
+        os.chmod(tmp, entry.get("mode", 0o644))
+    else:
+        return False
+    os.replace(tmp, path)
+    return True
+
+
+def rollback_snapshot(snapshot_id: str = "") -> list:
+    """Restore every file to how it was before the given apply (default: the latest).
+
+    Snapshots newer than it are unwound too. The rollback is itself snapshotted,
+    so it can be rolled back. Returns the restored paths.
+    """
+    flush_snapshots()  # let in-flight snapshots land
+    snaps = list_snapshots()
+    ids = [snap["id"] for snap in snaps]
+    if not snaps or (snapshot_id and snapshot_id not in ids):
+        raise RuntimeError(f"No snapshot {snapshot_id!r} to roll back to." if snapshot_id
+                           else "No snapshots to roll back to.")
+    target = ids.index(snapshot_id) if snapshot_id else 0
+
+    # Oldest record per path wins: that's its state before the target apply
+    wanted = {}
+    for snap in snaps[:target + 1]:
+        wanted.update(snap["files"])
+    begin_snapshot(f"rollback to {snaps[target]['id']}")
+    restored = []
+    try:
+        for path, entry in wanted.items():
+            snapshot_file(Path(path))
+            try:
+                if _restore_entry(Path(path), entry):
+                    restored.append(path)
+                    print(f"[rollback] {path}")
+            except OSError as e:
+                print(f"[rollback] {path}: {e}")
+    finally:
+        end_snapshot()
+
+    if str(WAYBAR_THEME) in restored:
+        waybar_reload()
+    if any(p.startswith(str(GHOSTTY_DIR) + os.sep) for p in restored):
+        ghostty_reload(GHOSTTY_CONFIG_DEFAULT)
+    if str(HYPR_CONF) in restored:
+        hypr_reload()
+    if snaps[target].get("previous_theme"):
+        update_state(last_theme=snaps[target]["previous_theme"])
+    return restored
+
+
 # ---------- perf helpers ----------
 
 def fast_hash(s: str) -> str:
     return hashlib.sha1(s.encode("utf-8")).hexdigest()
 
 
-def file_checksum(path: Path) -> str:
+def _hash_file(path: Path) -> str:
     try:
         h = hashlib.sha256()
-        with path.open("rb") as f:
+        with open(path, "rb") as f:
             for chunk in iter(lambda: f.read(262144), b""):
                 h.update(chunk)
         return h.hexdigest()
@@ -105,15 +579,86 @@ def file_checksum(path: Path) -> str:
         return ""
 
 
+def _fp_index() -> dict:
+    global _FP_INDEX
+    if _FP_INDEX is None:
+        try:
+            _FP_INDEX = json.loads(FP_INDEX_FILE.read_text(encoding="utf-8"))
+        except Exception:
+            _FP_INDEX = {}
+    return _FP_INDEX
+
+
+def _fp_lookup(st: os.stat_result) -> str:
+    """Cached digest for a stat result, or "" if unknown/stale."""
+    global _FP_DIRTY
+    key = f"{st.st_dev}:{st.st_ino}"
+    with _FP_LOCK:
+        ent = _fp_index().get(key)
+        if not ent or ent[0] != st.st_size or ent[1] != st.st_mtime_ns:
+            return ""
+        now = int(time.time())
+        if now - ent[3] > 3600:
+            ent[3] = now
+            _FP_DIRTY = True
+        return ent[2]
+
+
+def _fp_store(st: os.stat_result, digest: str):
+    global _FP_DIRTY
+    if not digest:
+        return
+    with _FP_LOCK:
+        _fp_index()[f"{st.st_dev}:{st.st_ino}"] = [st.st_size, st.st_mtime_ns, digest, int(time.time())]
+        _FP_DIRTY = True
+
+
+def file_checksum(path: Path, st: os.stat_result | None = None) -> str:
+    """SHA-256 of a file; hashed at most once per (dev, inode, size, mtime_ns)."""
+    try:
+        st = st or os.stat(path)
+    except OSError:
+        return ""
+    digest = _fp_lookup(st)
+    if not digest:
+        digest = _hash_file(path)
+        _fp_store(st, digest)
+    return digest
+
+
+def save_fingerprints():
+    """Evict old entries and persist the fingerprint index if it changed."""
+    global _FP_DIRTY
+    with _FP_LOCK:
+        if not _FP_DIRTY or _FP_INDEX is None:
+            return
+        cutoff = int(time.time()) - _FP_MAX_AGE
+        live = [(k, v) for k, v in _FP_INDEX.items() if v[3] >= cutoff]
+        if len(live) > _FP_MAX_ENTRIES:
+            live.sort(key=lambda kv: kv[1][3], reverse=True)
+            live = live[:_FP_MAX_ENTRIES]
+        _FP_INDEX.clear()
+        _FP_INDEX.update(live)
+        data = json.dumps(_FP_INDEX, separators=(",", ":"))
+        _FP_DIRTY = False
+    try:
+        _write_json_atomic(FP_INDEX_FILE, data)
+    except Exception as e:
+        print(f"[fingerprints] failed to save: {e}")
+
+
 def files_are_same(src: Path, dst: Path) -> bool:
-    if not (src.exists() and dst.exists() and src.is_file() and dst.is_file()):
+    try:
+        ss, ds = os.stat(src), os.stat(dst)
+    except OSError:
         return False
-    ss, ds = src.stat(), dst.stat()
-    if ss.st_size != ds.st_size:
+    if not (stat.S_ISREG(ss.st_mode) and stat.S_ISREG(ds.st_mode)):
         return False
-    if abs(ss.st_mtime - ds.st_mtime) < 0.001:
+    if ss.st_dev == ds.st_dev and ss.st_ino == ds.st_ino:
         return True
-    return file_checksum(src) == file_checksum(dst)
+    if ss.st_size != ds.st_size:
+        return False
+    return file_checksum(src, ss) == file_checksum(dst, ds)
 
 
 def ensure_dirs():
@@ -124,31 +669,91 @@ def ensure_dirs():
 
 
 def backup(path: Path):
-    if path.exists() and path.is_file():
-        bak = path.with_suffix(path.suffix + ".bak")
+    """Keep path's current state in the open snapshot before it's replaced."""
+    snapshot_file(path)
+
+
+FICLONE = 0x40049409  # linux/fs.h: _IOW(0x94, 9, int)
+
+
+def clone_file(src: Path, dst: Path) -> str:
+    """Copy src into a new dst: reflink, else copy_file_range, else a plain copy.
+
+    Returns the method used ("reflink", "copy_file_range" or "copy").
+    """
+    import shutil
+
+    with open(src, "rb") as fi, open(dst, "wb") as fo:
+        method = ""
         try:
-            shutil.copy2(path, bak)
-            print(f"[backup] {path} → {bak}")
-        except Exception:
+            import fcntl
+            fcntl.ioctl(fo.fileno(), FICLONE, fi.fileno())
+            method = "reflink"
+        except (ImportError, OSError):
             pass
+        if not method and hasattr(os, "copy_file_range"):
+            try:
+                remaining = os.fstat(fi.fileno()).st_size
+                while remaining > 0:
+                    n = os.copy_file_range(fi.fileno(), fo.fileno(), remaining)
+                    if n == 0:
+                        break
+                    remaining -= n
+                method = "copy_file_range"
+            except OSError:
+                fi.seek(0)
+                fo.seek(0)
+                fo.truncate()
+        if not method:
+            shutil.copyfileobj(fi, fo, 1 << 20)
+            method = "copy"
+    shutil.copystat(src, dst)
+    return method
+
+
+def _link_or_copy(src: Path, dst: Path, skip_when_same=True) -> str:
+    """Outcome of placing src at dst: "skip", "link", "copy", "missing" or "error"."""
+    with span("link_or_copy_file", cat="file", src=src, dst=dst) as sp:
+        outcome = _place_file(Path(src), Path(dst), skip_when_same)
+        sp["outcome"] = outcome
+        if outcome == "copy":
+            sp["bytes"] = os.path.getsize(dst)
+        return outcome
+
+
+def _is_store_object(st: os.stat_result, digest: str = "") -> bool:
+    """Whether st is the inode of a store object (same dev/inode as store_object(digest)).
+
+    Themes deduplicated by `store dedupe` share these read-only inodes, so they
+    are always reflinked/copied into live config, never hardlinked: editing the
+    live file mustn't write through into every theme with that content.
+    """
+    if st.st_nlink < 2 or not digest:
+        return False
+    try:
+        ost = os.stat(store_object(digest))
+    except OSError:
+        return False
+    return (ost.st_dev, ost.st_ino) == (st.st_dev, st.st_ino)
 
 
-def link_or_copy_file(src: Path, dst: Path, skip_when_same=True) -> bool:
-    """Prefer hardlink for instant apply; fallback to copy2."""
-    src = Path(src); dst = Path(dst)
+def _place_file(src: Path, dst: Path, skip_when_same: bool) -> str:
     if not src.exists() or not src.is_file():
         print(f"[missing] {src}")
-        return False
+        return "missing"
     dst.parent.mkdir(parents=True, exist_ok=True)
 
     try:
         if skip_when_same and dst.exists() and files_are_same(src, dst):
             print(f"[skip] identical: {src} == {dst}")
-            return False
+            return "skip"
 
-        if _TURBO:
+        backup(dst)  # also when absent: rollback then removes what this creates
+        sst = os.stat(src)
+        shared = sst.st_nlink > 1 and _is_store_object(sst, file_checksum(src, sst))
+        if _TURBO and not shared:
             # Remove before linking to avoid EXDEV/EEXIST noise
-            if dst.exists():
+            if dst.exists() or dst.is_symlink():
                 try:
                     dst.unlink()
                 except Exception:
@@ -156,103 +761,719 @@ def link_or_copy_file(src: Path, dst: Path, skip_when_same=True) -> bool:
             try:
                 os.link(src, dst)
                 print(f"[link] {src} ⟶ {dst}")
-                return True
+                return "link"
             except OSError:
                 pass  # cross-device or fs not supporting hardlinks -> fallback
 
-        if dst.exists():
-            backup(dst)
-        shutil.copy2(str(src), str(dst))
-        print(f"[copied] {src} → {dst}")
-        return True
+        # Copy beside and rename: never writes through a hardlink into another theme
+        tmp = dst.with_name(f".{dst.name}.hyprtheme-tmp")
+        method = clone_file(src, tmp)
+        if shared:
+            os.chmod(tmp, stat.S_IMODE(sst.st_mode) | stat.S_IWUSR)
+        os.replace(tmp, dst)
+        # The copy has the source's content: carry its digest over if known.
+        digest = _fp_lookup(sst)
+        if digest:
+            _fp_store(os.stat(dst), digest)
+        print(f"[copied:{method}] {src} → {dst}{' (store object)' if shared else ''}")
+        return "copy"
     except Exception as e:
         print(f"[error] file {src} → {dst}: {e}")
-        return False
+        return "error"
+
+
+def link_or_copy_file(src: Path, dst: Path, skip_when_same=True) -> bool:
+    """Prefer hardlink for instant apply; fallback to reflink/copy. True if dst changed."""
+    return _link_or_copy(src, dst, skip_when_same) in ("link", "copy")
+
+
+def _scan_tree(root: str, rel: str = "") -> list:
+    """[(relative path, absolute path)] of the regular files under root, via scandir."""
+    out = []
+    try:
+        with os.scandir(os.path.join(root, rel) if rel else root) as it:
+            for entry in it:
+                child = os.path.join(rel, entry.name) if rel else entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    out.extend(_scan_tree(root, child))
+                elif entry.is_file():
+                    out.append((child, entry.path))
+    except OSError:
+        pass
+    return out
+
+
+def _manifest_file(dst: Path) -> Path:
+    return STATE_DIR / "manifests" / f"{fast_hash(str(dst))}.json"
+
+
+def sync_tree(src: Path, dst: Path, prune=True) -> dict:
+    """Mirror src into dst in parallel, pruning files a previous sync put there.
+
+    Only files recorded in dst's manifest are ever pruned, so anything else in
+    dst (user files, app state) is left alone. Returns per-outcome counts plus
+    "pruned" and "bytes" (bytes copied rather than linked).
+    """
+    with span("sync_tree", src=src, dst=dst) as sp:
+        stats = _sync_tree(src, dst, prune)
+        sp.update(stats)
+        return stats
+
+
+def _sync_tree(src: Path, dst: Path, prune: bool) -> dict:
+    from concurrent.futures import ThreadPoolExecutor
+
+    stats = {"files": 0, "skip": 0, "link": 0, "copy": 0, "missing": 0, "error": 0,
+             "pruned": 0, "bytes": 0}
+    if not src.is_dir():
+        return stats
+    dst.mkdir(parents=True, exist_ok=True)
+    files = _scan_tree(str(src))
+    stats["files"] = len(files)
+
+    def one(item):
+        rel, path = item
+        outcome = _link_or_copy(Path(path), dst / rel)
+        return outcome, os.path.getsize(path) if outcome == "copy" else 0
+
+    with ThreadPoolExecutor(max_workers=min(8, max(1, len(files)))) as ex:
+        for outcome, nbytes in ex.map(one, files):
+            stats[outcome] += 1
+            stats["bytes"] += nbytes
+
+    manifest = _manifest_file(dst)
+    current = sorted(rel for rel, _path in files)
+    if prune:
+        try:
+            previous = json.loads(manifest.read_text(encoding="utf-8")).get("files", [])
+        except Exception:
+            previous = []
+        for rel in set(previous) - set(current):
+            stale = dst / rel
+            try:
+                backup(stale)
+                stale.unlink()
+                stats["pruned"] += 1
+                print(f"[prune] {stale}")
+                parent = stale.parent
+                while parent != dst and not any(parent.iterdir()):
+                    parent.rmdir()
+                    parent = parent.parent
+            except OSError:
+                pass
+    try:
+        manifest.parent.mkdir(parents=True, exist_ok=True)
+        _write_json_atomic(manifest, json.dumps({"dst": str(dst), "files": current}))
+    except Exception as e:
+        print(f"[sync] failed to write manifest: {e}")
+
+    print(f"[sync] {src} → {dst}: {stats['files']} files, {stats['link']} linked, "
+          f"{stats['copy']} copied ({stats['bytes']} B), {stats['skip']} unchanged, "
+          f"{stats['pruned']} pruned")
+    return stats
 
 
 def copy_tree_fast(src: Path, dst: Path) -> bool:
-    """Copy directory with skip-identical; hardlink new files if turbo."""
+    """Sync a directory (skip-identical, hardlink when turbo, prune stale). True if dst changed."""
     if not src.exists():
         return False
-    dst.mkdir(parents=True, exist_ok=True)
-    changed = False
-    for root, _dirs, files in os.walk(src):
-        rel = os.path.relpath(root, src)
-        dstdir = dst / rel if rel != "." else dst
-        dstdir.mkdir(parents=True, exist_ok=True)
-        for f in files:
-            s = Path(root) / f
-            d = dstdir / f
-            if link_or_copy_file(s, d):
-                changed = True
-    return changed
+    stats = sync_tree(src, dst)
+    return bool(stats["link"] or stats["copy"] or stats["pruned"])
+
+
+# ---------- hyprland ipc ----------
+
+def _hypr_socket_path() -> Path | None:
+    sig = os.environ.get("HYPRLAND_INSTANCE_SIGNATURE", "")
+    if not sig:
+        return None
+    runtime = os.environ.get("XDG_RUNTIME_DIR", "")
+    bases = [Path(runtime) / "hypr"] if runtime else []
+    bases.append(Path("/tmp/hypr"))  # Hyprland < 0.40
+    for base in bases:
+        p = base / sig / ".socket.sock"
+        if p.exists():
+            return p
+    return None
+
+
+def hypr_request(request: str, timeout: float = 2.0) -> str | None:
+    """Send one raw request over Hyprland's socket; None if it can't be reached."""
+    path = _hypr_socket_path()
+    if path is None:
+        return None
+    import socket
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            s.settimeout(timeout)
+            s.connect(str(path))
+            s.sendall(request.encode("utf-8"))
+            chunks = []
+            while True:
+                buf = s.recv(65536)
+                if not buf:
+                    break
+                chunks.append(buf)
+        return b"".join(chunks).decode("utf-8", "replace")
+    except OSError as e:
+        print(f"[ipc] {path}: {e}")
+        return None
+
+
+def hyprctl(*cmds: str) -> str:
+    """Run hyprctl commands in-process; several go out as one [[BATCH]] request."""
+    cmds = [c for c in cmds if c]
+    if not cmds:
+        return ""
+    request = cmds[0] if len(cmds) == 1 else "[[BATCH]]" + ";".join(cmds)
+    out = hypr_request(request)
+    if out is None:
+        # No socket (not under Hyprland, or old layout): let hyprctl find it
+        import subprocess
+        try:
+            out = subprocess.run(
+                ["hyprctl", "--batch", ";".join(cmds)], check=False,
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
+            ).stdout
+        except Exception as e:
+            print(f"[hyprctl] {e}")
+            return ""
+    bad = [line for line in out.split() if line != "ok"]
+    if bad:
+        print(f"[hyprctl] {request!r}: {out.strip()}")
+    return out
+
+
+# ---------- processes ----------
+
+def _proc_comm(pid) -> str:
+    try:
+        fd = os.open(f"/proc/{pid}/comm", os.O_RDONLY)
+    except OSError:
+        return ""
+    try:
+        return os.read(fd, 64).decode("utf-8", "replace").rstrip("\n")
+    except OSError:
+        return ""
+    finally:
+        os.close(fd)
+
+
+def find_pids(name: str) -> list:
+    """PIDs of running processes called `name`, from one scan of /proc.
+
+    Not cached: a ghostty window opened or a waybar restarted since the last
+    reload must be found too, and a PID may have been reused by then.
+    """
+    comm = name[:15]  # the kernel truncates comm to 15 chars
+    pids = []
+    try:
+        with os.scandir("/proc") as it:
+            for entry in it:
+                if entry.name.isdigit() and _proc_comm(entry.name) == comm:
+                    pids.append(int(entry.name))
+    except OSError:
+        pass
+    return pids
+
+
+def signal_process(name: str, sig: int) -> int:
+    """Send `sig` to every process called `name`; returns how many were signalled."""
+    sent = 0
+    for pid in find_pids(name):
+        try:
+            os.kill(pid, sig)
+            sent += 1
+        except (ProcessLookupError, PermissionError):
+            pass  # exited since the scan, or someone else's
+    return sent
 
 
 # ---------- hypr/waybar/wallpaper ----------
 
-def hypr_reload():
-    sh("hyprctl reload", check=False)
+# Keywords that may repeat (each line adds an entry); `keyword` would append, not replace
+HYPR_LIST_KEYWORDS = {"monitor", "workspace", "exec", "exec-once", "exec-shutdown", "execr", "execr-once",
+                      "env", "source", "animation", "bezier", "plugin", "permission", "gesture"}
+HYPR_LIST_PREFIXES = ("bind", "unbind", "windowrule", "layerrule")
+
+
+def parse_hypr_conf(text: str) -> tuple:
+    """Split hyprland.conf into (keywords, lists).
+
+    keywords maps single-valued options to values ({"general:gaps_in": "3"},
+    later lines win); lists maps repeatable keywords, and anything inside
+    device sections, to their values in order. $variables are expanded.
+    """
+    keywords, lists, variables, stack = {}, {}, {}, []
+    for raw in text.splitlines():
+        line = raw.strip()
+        if not line or line.startswith("#"):
+            continue
+        # "#" starts a comment, "##" is a literal "#"
+        line = line.replace("##", "\0").split("#", 1)[0].replace("\0", "#").strip()
+        if line.endswith("{") and "=" not in line:
+            stack.append(line[:-1].strip())
+            continue
+        if line == "}":
+            if stack:
+                stack.pop()
+            continue
+        if "=" not in line:
+            lists.setdefault("?", []).append(line)  # unknown syntax: compare verbatim
+            continue
+        key, value = (part.strip() for part in line.split("=", 1))
+        if key.startswith("$"):
+            variables[key] = value
+            continue
+        for name in sorted(variables, key=len, reverse=True):
+            if name in value:
+                value = value.replace(name, variables[name])
+        path = ":".join(stack + [key])
+        leaf = path.rsplit(":", 1)[-1]
+        if (leaf in HYPR_LIST_KEYWORDS or leaf.startswith(HYPR_LIST_PREFIXES)
+                or (stack and stack[0].split("[", 1)[0] == "device")):
+            lists.setdefault(path, []).append(value)
+        else:
+            keywords[path] = value
+    return keywords, lists
+
+
+def hypr_keyword_plan(old_text: str, new_text: str) -> list | None:
+    """`keyword` commands that turn the old config into the new one.
+
+    None when only a full reload can do it: a repeatable keyword changed, an
+    option was removed (there's no unset) or a value can't be sent as a keyword.
+    """
+    old_kw, old_lists = parse_hypr_conf(old_text)
+    new_kw, new_lists = parse_hypr_conf(new_text)
+    if old_lists != new_lists or old_kw.keys() - new_kw.keys():
+        return None
+    cmds = []
+    for key, value in new_kw.items():
+        if old_kw.get(key) == value:
+            continue
+        if not value or ";" in value:
+            return None
+        cmds.append(f"keyword {key} {value}")
+    return cmds
+
+
+def _hypr_autoreload() -> bool:
+    """Whether Hyprland reparses its config when the file changes (misc:disable_autoreload off)."""
+    try:
+        return not json.loads(hypr_request("j/getoption misc:disable_autoreload") or "")["int"]
+    except (ValueError, KeyError, TypeError):
+        return False
+
+
+def hypr_reload(old_text: str | None = None):
+    """Reload Hyprland; with the previous config text, push only changed keywords when that's enough.
+
+    Keyword updates only save the reparse with `misc:disable_autoreload = true`:
+    with Hyprland's default, it may notice the replaced hyprland.conf and
+    reparse it anyway. The keywords are still sent, since whether its watcher
+    fires depends on how the file was replaced; the result is right either way.
+    """
+    global _HYPR_AUTORELOAD_WARNED
+    if old_text is not None:
+        try:
+            plan = hypr_keyword_plan(old_text, HYPR_CONF.read_text(encoding="utf-8"))
+        except OSError:
+            plan = None
+        if plan == []:
+            print("[hypr] no effective changes, reload skipped")
+            return
+        if plan:
+            if not _HYPR_AUTORELOAD_WARNED and _hypr_autoreload():
+                _HYPR_AUTORELOAD_WARNED = True
+                print("[hypr] misc:disable_autoreload is off, so Hyprland may reparse the new config "
+                      "itself; set it to true to keep keyword-only updates cheap")
+            out = hyprctl(*plan)
+            if not any(line != "ok" for line in out.split()):
+                print(f"[hypr] applied {len(plan)} keyword(s) without reload")
+                return
+            print("[hypr] keyword update failed, falling back to reload")
+    hyprctl("reload")
 
 
 def waybar_reload():
-    sh("pkill -SIGUSR2 waybar || true", check=False)
+    import signal
+    signal_process("waybar", signal.SIGUSR2)
 
 
-def swww_ensure():
-    res = sh("pgrep -x swww-daemon || true", check=False)
-    if res.stdout.strip() == "":
-        sh("swww-daemon --format xrgb", check=False)
-        time.sleep(0.15 if _TURBO else 0.25)
+def _swww_sockets() -> list:
+    """Candidate swww-daemon socket paths, across swww's naming schemes."""
+    import glob
 
+    runtime = os.environ.get("XDG_RUNTIME_DIR") or "/tmp/swww"
+    display = os.path.basename(os.environ.get("WAYLAND_DISPLAY", "") or "wayland-0")
+    paths = sorted(glob.glob(os.path.join(runtime, f"{display}-swww-daemon*.socket")))  # >= 0.9
+    paths.append(os.path.join(runtime, f"swww-{display}.socket"))  # 0.8
+    paths.append(os.path.join(runtime, "swww.socket"))  # older
+    return paths
 
-def set_wallpaper(img: Path):
-    if not img.exists():
+
+def swww_ready() -> bool:
+    """True if something accepts connections on a swww-daemon socket."""
+    import socket
+    for path in _swww_sockets():
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+                s.connect(path)
+            return True
+        except OSError:
+            continue
+    return False
+
+
+def swww_ensure(timeout: float = 2.0) -> bool:
+    """Make sure swww-daemon is up; no subprocess once it's known to be running."""
+    global _SWWW_UP
+    if _SWWW_UP:
+        return True
+    if swww_ready():
+        _SWWW_UP = True
+        return True
+
+    # Already running but not listening yet: just wait for its socket
+    if not find_pids("swww-daemon"):
+        import subprocess
+        try:
+            subprocess.Popen(["swww-daemon", "--format", "xrgb"], stdout=subprocess.DEVNULL,
+                             stderr=subprocess.DEVNULL, start_new_session=True)
+        except OSError as e:
+            print(f"[swww] failed to start daemon: {e}")
+            return False
+    # Bounded exponential backoff instead of a fixed sleep
+    deadline = time.monotonic() + timeout
+    delay = 0.005
+    while time.monotonic() < deadline:
+        time.sleep(delay)
+        if swww_ready():
+            _SWWW_UP = True
+            return True
+        delay = min(delay * 2, 0.2)
+    print(f"[swww] daemon not ready after {timeout}s")
+    return False
+
+
+def hypr_monitors() -> list:
+    """Active outputs as [{"name", "width", "height"}] in device pixels ([] if unknown)."""
+    out = hypr_request("j/monitors")
+    if out is None:
+        import subprocess
+        try:
+            out = subprocess.run(["hyprctl", "-j", "monitors"], check=False,
+                                 stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True).stdout
+        except Exception:
+            return []
+    try:
+        monitors = json.loads(out)
+    except ValueError:
+        return []
+    outputs = []
+    for m in monitors:
+        if m.get("disabled") or not m.get("width") or not m.get("height"):
+            continue
+        w, h = int(m["width"]), int(m["height"])
+        if m.get("transform", 0) % 2:  # rotated 90/270
+            w, h = h, w
+        outputs.append({"name": m.get("name", ""), "width": w, "height": h})
+    return outputs
+
+
+def _scaled_wallpaper_path(digest: str, width: int, height: int) -> Path:
+    return WALLPAPER_CACHE_DIR / f"{digest[:24]}-{width}x{height}.ppm"
+
+
+def _render_scaled(src: str, dst: str, width: int, height: int) -> str:
+    """Cover-crop src to width×height and write it to dst (runs in worker processes too)."""
+    from PIL import Image, ImageOps
+
+    import tempfile
+
+    with Image.open(src) as im:
+        scaled = ImageOps.fit(im.convert("RGB"), (width, height), Image.LANCZOS)
+    # Unique per writer: a prestage thread, apply and pool workers may render the same dst
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dst), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            scaled.save(f, "PPM")
+        os.replace(tmp, dst)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+    return dst
+
+
+def scaled_wallpaper(img: Path, width: int, height: int) -> Path:
+    """Cached copy of img scaled for one output; the original if scaling isn't possible."""
+    digest = file_checksum(img)
+    if not digest:
+        return img
+    dst = _scaled_wallpaper_path(digest, width, height)
+    with _SCALING_LOCK:
+        lock = _SCALING.setdefault(dst, threading.Lock())
+    with lock:  # a prestage already scaling this one: wait for it rather than render it again
+        try:
+            os.utime(dst)  # LRU mark for _trim_wallpaper_cache
+            return dst
+        except OSError:
+            pass
+        try:
+            WALLPAPER_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            _render_scaled(str(img), str(dst), width, height)
+            return dst
+        except Exception as e:
+            print(f"[wallpaper] scaling failed, using original: {e}")
+            return img
+
+
+def _trim_wallpaper_cache():
+    try:
+        entries = [(e.stat().st_mtime, e.stat().st_size, e.path) for e in os.scandir(WALLPAPER_CACHE_DIR)
+                   if e.name.endswith(".ppm")]
+    except OSError:
         return
+    total = sum(size for _m, size, _p in entries)
+    for _mtime, size, path in sorted(entries):
+        if total <= WALLPAPER_CACHE_MAX_BYTES:
+            break
+        try:
+            os.unlink(path)
+            total -= size
+        except OSError:
+            pass
+
+
+def warm_wallpaper_cache(outputs: list | None = None, background: bool = True):
+    """Pre-scale every theme's wallpaper for the current outputs in a process pool."""
+    def work():
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        sizes = {(o["width"], o["height"]) for o in (outputs if outputs is not None else hypr_monitors())}
+        jobs = []
+        for t in list_themes():
+            wp = t.get("wallpaper", "")
+            digest = file_checksum(Path(wp)) if wp and os.path.isfile(wp) else ""
+            for w, h in sizes:
+                if digest and not _scaled_wallpaper_path(digest, w, h).exists():
+                    jobs.append((wp, str(_scaled_wallpaper_path(digest, w, h)), w, h))
+        save_fingerprints()
+        if not jobs:
+            return
+        try:
+            WALLPAPER_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            # Not fork: this runs on a thread of a threaded process (daemon, GUI), and a forked
+            # child can inherit a lock some other thread held, then hang on it
+            ctx = multiprocessing.get_context("forkserver")
+            with ProcessPoolExecutor(max_workers=min(4, os.cpu_count() or 1), mp_context=ctx) as ex:
+                for fut in [ex.submit(_render_scaled, *job) for job in jobs]:
+                    try:
+                        fut.result()
+                    except Exception as e:
+                        print(f"[wallpaper] prescale failed: {e}")
+        except Exception as e:
+            print(f"[wallpaper] prescale pool failed: {e}")
+        _trim_wallpaper_cache()
+        print(f"[wallpaper] prescaled {len(jobs)} wallpapers")
+
+    if not background:
+        work()
+        return None
+    th = threading.Thread(target=work, name="wallpaper-prescale", daemon=True)
+    th.start()
+    return th
+
+
+def set_wallpaper(img: Path) -> bool:
+    """Show img on every output through swww; True if swww accepted it everywhere."""
+    global _SWWW_UP
+    if not img.exists():
+        return False
+    import subprocess
+
     swww_ensure()
     # Shorter transition when turbo
     duration = 0.18 if _TURBO else 0.42
-    sh(
-        f"swww img '{img}' --transition-type any "
-        "--transition-fps 144 --transition-step 144 "
-        f"--invert-y --transition-duration {duration}",
-        check=False
-    )
+    args = ["--transition-type", "any", "--transition-fps", "144", "--transition-step", "144",
+            "--invert-y", "--transition-duration", str(duration)]
+
+    def swww_img(path, output=""):
+        cmd = ["swww", "img", *(["-o", output] if output else []), str(path), *args]
+        return subprocess.run(cmd, check=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE).returncode
+
+    outputs = hypr_monitors()
+    with span("swww_img", outputs=len(outputs) or 1):
+        codes = _swww_all(img, outputs, swww_img)
+    if any(codes):
+        _SWWW_UP = False  # daemon may have died: probe its socket again next time
+        print(f"[swww] img failed (exit {max(codes)})")
+        return False
+    return True
 
 
-# ---------- palette/css for the app (async on turbo) ----------
+def _swww_all(img: Path, outputs: list, swww_img) -> list:
+    from concurrent.futures import ThreadPoolExecutor
 
-def extract_palette(img_path: Path):
-    try:
-        from colorthief import ColorThief
-        from PIL import Image
+    if not outputs:
+        codes = [swww_img(img)]
+    else:
+        # One image per output, all transitions started together
+        with ThreadPoolExecutor(max_workers=len(outputs)) as ex:
+            codes = list(ex.map(lambda o: swww_img(scaled_wallpaper(img, o["width"], o["height"]), o["name"]),
+                                outputs))
+    return codes
 
-        if not img_path.exists():
-            return None
 
-        with Image.open(img_path) as im:
-            im = im.convert("RGB")
-            im.thumbnail((340, 340))
-            tmp = img_path.with_suffix(".m3thumb.jpg")
-            im.save(tmp, "JPEG", quality=68)
+# ---------- palette/css for the app (async on turbo) ----------
 
-        ct = ColorThief(str(tmp))
-        palette = ct.get_palette(color_count=6)
+def _palette_cache() -> dict:
+    global _PALETTE_CACHE
+    if _PALETTE_CACHE is None:
+        try:
+            _PALETTE_CACHE = json.loads(PALETTE_CACHE_FILE.read_text(encoding="utf-8"))
+        except Exception:
+            _PALETTE_CACHE = {}
+    return _PALETTE_CACHE
+
+
+def _palette_cache_get(key: str):
+    with _PALETTE_LOCK:
+        ent = _palette_cache().get(key)
+        if not ent:
+            return None
+        ent["used"] = int(time.time())
+        return dict(ent["palette"])
+
+
+def _palette_cache_put(key: str, palette: dict):
+    with _PALETTE_LOCK:
+        cache = _palette_cache()
+        cache[key] = {"palette": palette, "used": int(time.time())}
+        if len(cache) > _PALETTE_MAX_ENTRIES:
+            for old in sorted(cache, key=lambda k: cache[k]["used"])[:len(cache) - _PALETTE_MAX_ENTRIES]:
+                del cache[old]
+        data = json.dumps(cache, separators=(",", ":"))
+    try:
+        _write_json_atomic(PALETTE_CACHE_FILE, data)
+    except Exception as e:
+        print(f"[palette] failed to save cache: {e}")
+
+
+PALETTE_ROLES = ("primary", "secondary", "tertiary", "neutral", "surface", "outline")
+
+
+def _load_thumbnail(img_path: Path):
+    from PIL import Image
+
+    with Image.open(img_path) as im:
+        im = im.convert("RGB")
+        im.thumbnail((340, 340))
+        return im
+
+
+def palette_numpy(im, color_count: int = 6) -> list:
+    """Dominant colors of a PIL image: 5-bit histogram + weighted k-means.
+
+    Deterministic (farthest-point seeding from the most common color), ordered
+    by population. Near-white pixels are ignored, like ColorThief does.
+    """
+    import numpy as np
+
+    px = np.asarray(im, dtype=np.uint8).reshape(-1, 3)
+    px = px[~(px > 250).all(axis=1)]
+    if len(px) == 0:
+        return [(255, 255, 255)] * color_count
+
+    q = (px >> 3).astype(np.int32)
+    idx = (q[:, 0] << 10) | (q[:, 1] << 5) | q[:, 2]
+    counts = np.bincount(idx, minlength=32768)
+    bins = np.nonzero(counts)[0]
+    weights = counts[bins].astype(np.float64)
+    # Mean of the real pixels in each bin rather than the bin center
+    colors = np.stack([np.bincount(idx, weights=px[:, c], minlength=32768)[bins] for c in range(3)], axis=1)
+    colors /= weights[:, None]
+
+    k = min(color_count, len(colors))
+    seeds = [int(np.argmax(weights))]
+    d2 = ((colors - colors[seeds[0]]) ** 2).sum(axis=1)
+    for _ in range(1, k):
+        i = int(np.argmax(d2 * weights))
+        seeds.append(i)
+        d2 = np.minimum(d2, ((colors - colors[i]) ** 2).sum(axis=1))
+    centers = colors[seeds].copy()
+
+    pop = weights[seeds]
+    for _ in range(24):
+        labels = ((colors[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2).argmin(axis=1)
+        pop = np.bincount(labels, weights=weights, minlength=k)
+        sums = np.stack([np.bincount(labels, weights=weights * colors[:, c], minlength=k) for c in range(3)], axis=1)
+        moved = centers.copy()
+        live = pop > 0
+        moved[live] = sums[live] / pop[live, None]
+        converged = np.abs(moved - centers).max() < 0.5
+        centers = moved
+        if converged:
+            break
+
+    order = np.argsort(-pop, kind="stable")
+    result = [tuple(int(round(v)) for v in centers[i]) for i in order]
+    while len(result) < color_count:
+        result.append(result[-1])
+    return result
+
+
+def palette_colorthief(im, color_count: int = 6) -> list:
+    import io
+    from colorthief import ColorThief
+
+    # Hand the thumbnail over in memory; BMP is lossless and instant
+    buf = io.BytesIO()
+    im.save(buf, "BMP")
+    buf.seek(0)
+    return ColorThief(buf).get_palette(color_count=color_count)
+
+
+def _extract_palette_uncached(img_path: Path):
+    try:
+        im = _load_thumbnail(img_path)
+        try:
+            colors = palette_numpy(im)
+        except ImportError:
+            colors = palette_colorthief(im)
 
         def hexify(rgb):
             return "#{:02x}{:02x}{:02x}".format(*rgb)
 
-        return {
-            "primary": hexify(palette[0]),
-            "secondary": hexify(palette[1]),
-            "tertiary": hexify(palette[2]),
-            "neutral": hexify(palette[3]),
-            "surface": hexify(palette[4]),
-            "outline": hexify(palette[5])
-        }
+        return {role: hexify(rgb) for role, rgb in zip(PALETTE_ROLES, colors)}
     except Exception:
         return None
 
 
+def extract_palette(img_path: Path):
+    """Palette for a wallpaper, cached by its content hash and PALETTE_VERSION."""
+    if not img_path.exists():
+        return None
+    with span("extract_palette", img=img_path) as sp:
+        digest = file_checksum(img_path)
+        key = f"v{PALETTE_VERSION}:{digest}"
+        if digest:
+            palette = _palette_cache_get(key)
+            if palette:
+                sp["outcome"] = "cached"
+                return palette
+        palette = _extract_palette_uncached(img_path)
+        sp["outcome"] = "extracted" if palette else "failed"
+        if palette and digest:
+            _palette_cache_put(key, palette)
+        return palette
+
+
 def generate_css_vars(palette):
     if not palette:
         return ""
@@ -270,7 +1491,7 @@ def generate_css_vars(palette):
 
 def write_runtime_css_vars(palette):
     css = generate_css_vars(palette)
-    target = Path(__file__).parent / "style-vars.css"
+    target = RUNTIME_CSS_FILE
     try:
         if target.exists():
             old = target.read_text(encoding="utf-8")
@@ -282,69 +1503,185 @@ def write_runtime_css_vars(palette):
         print(f"[css] failed to write {target}: {e}")
 
 
-def update_palette_async(img_path: Path):
+def update_palette_async(img_path: Path, wait_for: threading.Thread | None = None):
     def worker():
+        if wait_for is not None:
+            wait_for.join()  # a prestage already extracting this palette
         pal = extract_palette(img_path)
         if pal:
             write_runtime_css_vars(pal)
-    threading.Thread(target=worker, daemon=True).start()
+        save_fingerprints()
+    threading.Thread(target=worker, name="palette-css", daemon=True).start()
 
 
 # ---------- GTK / cursor ----------
 
-def set_gsettings(theme_name="", icon_theme="", cursor_theme="", font_name="", adw_scheme=""):
-    if _HAVE_GIO:
-        try:
-            s = Gio.Settings.new("org.gnome.desktop.interface")
-            if theme_name:
-                s.set_string("gtk-theme", theme_name)
-            if icon_theme:
-                s.set_string("icon-theme", icon_theme)
-            if cursor_theme:
-                s.set_string("cursor-theme", cursor_theme)
-            if font_name:
-                s.set_string("font-name", font_name)
-            if adw_scheme in ("default", "prefer-dark", "prefer-light"):
-                s.set_string("color-scheme", adw_scheme)
-            s.apply()
-            return
+_GIO = None
+_GIO_SETTINGS = None
+
+
+def _gio():
+    """Gio for fast, in-process gsettings; imported on first use, None if missing."""
+    global _GIO
+    if _GIO is None:
+        try:
+            import gi
+            gi.require_version("Gio", "2.0")
+            from gi.repository import Gio  # type: ignore
+            _GIO = Gio
+        except Exception:
+            _GIO = False
+    return _GIO or None
+
+
+def _interface_settings():
+    """Cached Gio.Settings for org.gnome.desktop.interface (None without Gio)."""
+    global _GIO_SETTINGS
+    Gio = _gio()
+    if Gio and _GIO_SETTINGS is None:
+        _GIO_SETTINGS = Gio.Settings.new("org.gnome.desktop.interface")
+    return _GIO_SETTINGS
+
+
+DCONF_INTERFACE = "/org/gnome/desktop/interface/"
+
+
+def _gvariant_str(value: str) -> str:
+    return "'" + value.replace("\\", "\\\\").replace("'", "\\'") + "'"
+
+
+def _parse_gvariant_str(text: str) -> str:
+    text = text.strip()
+    if len(text) >= 2 and text[0] == text[-1] and text[0] in "'\"":
+        text = text[1:-1]
+        return text.replace("\\'", "'").replace('\\"', '"').replace("\\\\", "\\")
+    return text
+
+
+def _dconf_current() -> dict | None:
+    """Current org.gnome.desktop.interface values via one `dconf dump`."""
+    import subprocess
+    try:
+        res = subprocess.run(["dconf", "dump", DCONF_INTERFACE], check=True,
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    except Exception:
+        return None
+    current = {}
+    for line in res.stdout.splitlines():
+        key, sep, value = line.partition("=")
+        if sep and not line.startswith("["):
+            current[key.strip()] = _parse_gvariant_str(value)
+    return current
+
+
+def set_gsettings(theme_name="", icon_theme="", cursor_theme="", font_name="", adw_scheme="") -> list | None:
+    """Write only the interface keys that differ, in one transaction.
+
+    Returns the list of keys that changed, or None if that couldn't be determined.
+    """
+    wanted = {
+        "gtk-theme": theme_name,
+        "icon-theme": icon_theme,
+        "cursor-theme": cursor_theme,
+        "font-name": font_name,
+        "color-scheme": adw_scheme if adw_scheme in ("default", "prefer-dark", "prefer-light") else "",
+    }
+    wanted = {k: v for k, v in wanted.items() if v}
+
+    if _gio():
+        try:
+            s = _interface_settings()
+            changed = [k for k, v in wanted.items() if s.get_string(k) != v]
+            if changed:
+                s.delay()
+                for k in changed:
+                    s.set_string(k, wanted[k])
+                s.apply()
+                print(f"[gio] set {', '.join(changed)}")
+            return changed
         except Exception as e:
             print(f"[gio] settings failed, falling back: {e}")
 
-    def gset(schema, key, value):
-        if not value:
-            return
+    import subprocess
+
+    current = _dconf_current()
+    if current is not None:
+        # Keys at their schema default aren't in the dump and count as changed
+        changed = [k for k, v in wanted.items() if current.get(k) != v]
+        if not changed:
+            return changed
+        keyfile = "[/]\n" + "".join(f"{k}={_gvariant_str(wanted[k])}\n" for k in changed)
+        try:
+            subprocess.run(["dconf", "load", DCONF_INTERFACE], input=keyfile, check=True,
+                           stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+            print(f"[dconf] set {', '.join(changed)}")
+            return changed
+        except Exception as e:
+            print(f"[dconf] load failed, falling back: {e}")
+
+    for key, value in wanted.items():
         try:
             subprocess.run(
-                f"gsettings set {schema} {key} \"{value}\"",
-                shell=True, check=False,
+                ["gsettings", "set", "org.gnome.desktop.interface", key, value], check=False,
                 stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
             )
         except Exception as e:
             print(f"[gsettings] failed for {key}: {e}")
+    return None
 
-    gset("org.gnome.desktop.interface", "gtk-theme", theme_name)
-    gset("org.gnome.desktop.interface", "icon-theme", icon_theme)
-    gset("org.gnome.desktop.interface", "cursor-theme", cursor_theme)
-    gset("org.gnome.desktop.interface", "font-name", font_name)
-    if adw_scheme in ("default", "prefer-dark", "prefer-light"):
-        gset("org.gnome.desktop.interface", "color-scheme", adw_scheme)
 
-
-def set_wayland_cursor(cursor_theme: str = "", size: int = 24):
+def set_wayland_cursor(cursor_theme: str = "", size: int = 24) -> bool:
+    """Set the cursor through Hyprland; True if it answered "ok"."""
     if not cursor_theme:
-        return
-    try:
-        subprocess.run(f"hyprctl setcursor '{cursor_theme}' {size}", shell=True, check=False)
-        print(f"[cursor] set via hyprctl: {cursor_theme} ({size})")
-    except Exception as e:
-        print(f"[cursor] failed to apply: {e}")
+        return True
+    out = hyprctl(f"setcursor {cursor_theme} {size}").split()
+    if not out or any(word != "ok" for word in out):
+        print(f"[cursor] failed to apply: {cursor_theme} ({size})")
+        return False
+    print(f"[cursor] set via hyprctl: {cursor_theme} ({size})")
+    return True
 
 
 # ---------- Ghostty ----------
 
+def _ghostty_handles_sigusr2() -> bool:
+    """Whether the installed Ghostty reloads its config on SIGUSR2 (>= 1.2).
+
+    Older versions don't handle the signal and die of it. `ghostty +version`
+    runs once per binary (path, inode, mtime); the answer is kept in state.
+    """
+    import shutil
+    exe = shutil.which("ghostty")
+    try:
+        st = os.stat(exe) if exe else None
+    except OSError:
+        st = None
+    if st is None:
+        return False
+    stamp = f"{exe}:{st.st_ino}:{st.st_mtime_ns}"
+    cached = load_state().get("ghostty_sigusr2")
+    if cached and cached[0] == stamp:
+        return cached[1]
+
+    import re
+    import subprocess
+    try:
+        out = subprocess.run([exe, "+version"], check=False, stdout=subprocess.PIPE,
+                             stderr=subprocess.DEVNULL, text=True, timeout=5).stdout
+    except (OSError, subprocess.TimeoutExpired):
+        out = ""
+    m = re.search(r"(\d+)\.(\d+)", out)
+    ok = bool(m) and (int(m[1]), int(m[2])) >= (1, 2)
+    update_state(ghostty_sigusr2=[stamp, ok])
+    return ok
+
+
 def ghostty_reload(config_path: Path | None = None):
-    sh("ghostty +action=reload-config || true", check=False)
+    import signal
+    if _ghostty_handles_sigusr2():
+        signal_process("ghostty", signal.SIGUSR2)
+    else:
+        sh("ghostty +action=reload-config || true", check=False)
     if config_path and config_path.exists():
         try:
             os.utime(config_path, None)
@@ -356,127 +1693,975 @@ def ghostty_reload(config_path: Path | None = None):
 # ---------- ZenBrowser ----------
 
 def apply_zen_userstyles(theme_dir: Path, profile_dir: Path,
-                         userchrome_rel: str, usercontent_rel: str):
+                         userchrome_rel: str, usercontent_rel: str) -> bool:
+    """Place the theme's userChrome/userContent; False if a file was missing or failed."""
     if not profile_dir:
-        return
+        return True
     profile_dir = Path(os.path.expanduser(str(profile_dir)))
     chrome_dir = profile_dir / "chrome"
     chrome_dir.mkdir(parents=True, exist_ok=True)
 
+    outcomes = []
     if userchrome_rel:
-        link_or_copy_file(theme_dir / userchrome_rel, chrome_dir / "userChrome.css")
+        outcomes.append(_link_or_copy(theme_dir / userchrome_rel, chrome_dir / "userChrome.css"))
     if usercontent_rel:
-        link_or_copy_file(theme_dir / usercontent_rel, chrome_dir / "userContent.css")
+        outcomes.append(_link_or_copy(theme_dir / usercontent_rel, chrome_dir / "userContent.css"))
+    return not any(o in ("missing", "error") for o in outcomes)
 
 
-# ---------- theme listing with caching ----------
+# ---------- asset store (content-addressed, hardlinked) ----------
 
-def _themes_signature() -> str:
-    if not THEME_ROOT.exists():
-        return "empty"
-    parts = []
+def store_object(digest: str) -> Path:
+    return STORE_OBJECTS / digest[:2] / digest[2:]
+
+
+def _store_object_ok(obj: Path, digest: str, st: os.stat_result | None = None) -> bool:
+    """Whether obj exists and still has the content its name says.
+
+    Objects are read-only, but an in-place edit by the owner (chmod, editor
+    force-write) would otherwise get linked into ever more themes.
+    """
+    if file_checksum(obj, st) == digest:
+        return True
+    if obj.exists():
+        print(f"[store] {obj} no longer matches its digest, replacing it")
+    return False
+
+
+def _seal(path: Path):
+    """Make an object read-only; every hardlink into a theme shares the mode."""
+    mode = stat.S_IMODE(os.stat(path).st_mode)
+    os.chmod(path, mode & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+
+
+def store_put_stream(stream) -> str:
+    """Write a stream into the store while hashing it (one pass, no extra copy); returns the digest."""
+    import tempfile
+
+    tmpdir = STORE_DIR / "tmp"
+    tmpdir.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=tmpdir)
+    h = hashlib.sha256()
     try:
-        for tdir in sorted([p for p in THEME_ROOT.iterdir() if p.is_dir()]):
-            tj = tdir / "theme.json"
-            st = tj.stat() if tj.exists() else None
-            parts.append(f"{tdir.name}:{st.st_mtime if st else 0}:{st.st_size if st else 0}")
-    except Exception:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in iter(lambda: stream.read(1 << 20), b""):
+                h.update(chunk)
+                f.write(chunk)
+        digest = h.hexdigest()
+        obj = store_object(digest)
+        if _store_object_ok(obj, digest):
+            os.unlink(tmp)
+        else:
+            obj.parent.mkdir(parents=True, exist_ok=True)
+            _seal(Path(tmp))
+            os.replace(tmp, obj)
+            _fp_store(os.stat(obj), digest)
+        return digest
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def _link_over(src: Path, dst: Path):
+    """Atomically make dst a hardlink of src."""
+    tmp = dst.with_name(f".{dst.name}.hyprtheme-lnk")
+    try:
+        tmp.unlink()
+    except FileNotFoundError:
         pass
-    return fast_hash("|".join(parts))
+    os.link(src, tmp)
+    os.replace(tmp, dst)
 
 
-def list_themes():
-    global _THEME_CACHE_SIG, _THEME_CACHE
-    sig = _themes_signature()
-    if sig == _THEME_CACHE_SIG and _THEME_CACHE is not None:
-        return _THEME_CACHE
-
-    themes = []
-    if not THEME_ROOT.exists():
-        _THEME_CACHE_SIG, _THEME_CACHE = sig, themes
-        return themes
-
-    for tdir in sorted([p for p in THEME_ROOT.iterdir() if p.is_dir()]):
-        tj = tdir / "theme.json"
-        if not tj.exists():
-            continue
+def store_add_file(path: Path) -> tuple:
+    """Back path by its store object; returns (digest, outcome).
+
+    outcome is "added" (this inode became the object, now read-only), "linked"
+    (replaced by a link to an existing object, freeing its blocks), "stored"
+    (already was) or "error".
+    """
+    try:
+        st = os.stat(path)
+        digest = file_checksum(path, st)
+        if not digest:
+            return "", "error"
+        obj = store_object(digest)
         try:
-            meta = json.loads(tj.read_text(encoding="utf-8"))
+            ost = os.stat(obj)
+        except FileNotFoundError:
+            ost = None
+        if ost and (ost.st_dev, ost.st_ino) == (st.st_dev, st.st_ino):
+            _seal(obj)
+            return digest, "stored"
+        if ost is None or not _store_object_ok(obj, digest, ost):
+            obj.parent.mkdir(parents=True, exist_ok=True)
+            _seal(path)
+            _link_over(path, obj)
+            return digest, "added"
+        _link_over(obj, path)
+        return digest, "linked"
+    except OSError as e:
+        print(f"[store] {path}: {e}")
+        return "", "error"
+
+
+def store_ingest(root: Path) -> dict:
+    """Deduplicate every regular file under root through the store.
+
+    Only run on request (`store dedupe`): the files become read-only links to
+    their objects, and apply copies store objects rather than hardlinking them.
+    """
+    stats = {"files": 0, "added": 0, "linked": 0, "stored": 0, "error": 0, "saved_bytes": 0}
+    for dirpath, _dirs, names in os.walk(root):
+        for name in names:
+            path = Path(dirpath) / name
+            if path.is_symlink() or not path.is_file() or name.endswith((".hyprtheme-tmp", ".hyprtheme-lnk")):
+                continue
+            size = path.stat().st_size
+            _digest, outcome = store_add_file(path)
+            stats["files"] += 1
+            stats[outcome] += 1
+            if outcome == "linked":
+                stats["saved_bytes"] += size
+    save_fingerprints()
+    return stats
+
+
+def store_gc() -> dict:
+    """Drop objects nothing links to any more (link count 1)."""
+    stats = {"removed": 0, "freed_bytes": 0}
+    try:
+        shards = list(os.scandir(STORE_OBJECTS))
+    except OSError:
+        return stats
+    for shard in shards:
+        for entry in os.scandir(shard.path):
+            st = entry.stat(follow_symlinks=False)
+            if st.st_nlink == 1:
+                os.unlink(entry.path)
+                stats["removed"] += 1
+                stats["freed_bytes"] += st.st_size
+    return stats
+
+
+def store_status() -> dict:
+    objects = size = unreferenced = 0
+    for dirpath, _dirs, names in os.walk(STORE_OBJECTS):
+        for name in names:
+            st = os.stat(os.path.join(dirpath, name))
+            objects += 1
+            size += st.st_size
+            unreferenced += st.st_nlink == 1
+    return {"objects": objects, "bytes": size, "unreferenced": unreferenced}
+
+
+def _pack_members(pack: Path):
+    """(name, open()) per regular file of a .zip or (compressed) .tar, read sequentially."""
+    import zipfile
+
+    if zipfile.is_zipfile(pack):
+        with zipfile.ZipFile(pack) as z:
+            for info in z.infolist():
+                if not info.is_dir():
+                    yield info.filename, lambda info=info: z.open(info)
+    else:
+        import tarfile
+        with tarfile.open(pack, "r|*") as tar:  # stream mode: no seeking, no temp copy
+            for member in tar:
+                if member.isfile():
+                    yield member.name, lambda member=member: tar.extractfile(member)
+
+
+def import_theme_pack(pack: Path, force: bool = False) -> list:
+    """Stream a theme pack into the store and link its themes into THEME_ROOT; returns their ids.
 
-            wallpaper_rel = meta.get("wallpaper", "")
-            preview_rel = meta.get("preview") or meta.get("preview_image") or wallpaper_rel
+    A pack may hold one theme (theme.json at its top, named after the pack) or
+    several theme directories. Existing themes are only replaced with force.
+    """
+    import shutil
 
-            item = {
-                "id": tdir.name,
-                "name": meta.get("name", tdir.name),
-                "dir": str(tdir),
+    pack = Path(pack)
+    stage = STORE_DIR / f"import-{os.getpid()}"
+    shutil.rmtree(stage, ignore_errors=True)
+    stage.mkdir(parents=True)
+    try:
+        count = 0
+        for name, opener in _pack_members(pack):
+            rel = Path(name)
+            if rel.is_absolute() or ".." in rel.parts or not rel.parts:
+                print(f"[import] skipping unsafe path {name!r}")
+                continue
+            with opener() as f:
+                digest = store_put_stream(f)
+            dst = stage / rel
+            dst.parent.mkdir(parents=True, exist_ok=True)
+            os.link(store_object(digest), dst)
+            count += 1
+
+        stem = pack.name
+        for ext in (".tar.gz", ".tar.xz", ".tar.bz2", ".tgz", ".tar", ".zip"):
+            if stem.endswith(ext):
+                stem = stem[:-len(ext)]
+                break
+        imported = []
+        for tj in sorted(stage.rglob("theme.json")):
+            src = tj.parent
+            if not tj.exists():
+                continue  # nested in a theme moved already
+            theme_id = stem if src == stage else src.name
+            dst = THEME_ROOT / theme_id
+            if dst.exists():
+                if not force:
+                    print(f"[import] {theme_id} exists, skipped (use --force to replace)")
+                    continue
+                shutil.rmtree(dst)
+            THEME_ROOT.mkdir(parents=True, exist_ok=True)
+            shutil.move(str(src), str(dst))  # a rename when the store shares the filesystem
+            imported.append(theme_id)
+        print(f"[import] {pack.name}: {count} files, themes: {', '.join(imported) or '-'}")
+    finally:
+        shutil.rmtree(stage, ignore_errors=True)
+        save_fingerprints()
+    if imported:
+        refresh_themes()
+    return imported
 
-                "hypr": str(tdir / meta.get("hyprland_conf", "hyprland.conf")),
-                "waybar": str(tdir / meta.get("waybar_css", "waybar.css")),
-                "wallpaper": str(tdir / wallpaper_rel) if wallpaper_rel else "",
-                "preview": str(tdir / preview_rel) if preview_rel else "",
 
-                "gtk_theme": meta.get("gtk_theme", ""),
-                "gtk_icon_theme": meta.get("gtk_icon_theme", ""),
-                "gtk_cursor_theme": meta.get("gtk_cursor_theme", ""),
-                "gtk_font_name": meta.get("gtk_font_name", ""),
-                "adw_color_scheme": meta.get("adw_color_scheme", ""),
+# ---------- theme listing with caching ----------
 
-                "ghostty_src": meta.get("ghostty_src", "ghostty"),
-                "ghostty_target": meta.get("ghostty_target", "config"),
+def _theme_stamps() -> dict:
+    """{theme id: [mtime_ns, size] of its theme.json}, from one scandir pass."""
+    stamps = {}
+    try:
+        with os.scandir(THEME_ROOT) as it:
+            for entry in it:
+                if not entry.is_dir():
+                    continue
+                try:
+                    st = os.stat(os.path.join(entry.path, "theme.json"))
+                except OSError:
+                    continue
+                stamps[entry.name] = [st.st_mtime_ns, st.st_size]
+    except OSError:
+        pass
+    return stamps
+
+
+def _themes_signature(stamps: dict | None = None) -> str:
+    if stamps is None:
+        stamps = _theme_stamps()
+    try:
+        root = THEME_ROOT.stat().st_mtime_ns
+    except OSError:
+        return "empty"
+    parts = [str(root)] + [f"{k}:{v[0]}:{v[1]}" for k, v in sorted(stamps.items())]
+    return fast_hash("|".join(parts))
 
-                "zen_profile_dir": meta.get("zen_profile_dir", ""),
-                "zen_userchrome": meta.get("zen_userchrome", ""),
-                "zen_usercontent": meta.get("zen_usercontent", ""),
-            }
-            themes.append(item)
-        except Exception as e:
-            print(f"[theme] failed to parse {tj}: {e}")
-            continue
 
-    _THEME_CACHE_SIG, _THEME_CACHE = sig, themes
+def _parse_theme(tdir: Path) -> dict | None:
+    tj = tdir / "theme.json"
+    if not tj.exists():
+        return None
+    try:
+        meta = json.loads(tj.read_text(encoding="utf-8"))
+
+        wallpaper_rel = meta.get("wallpaper", "")
+        preview_rel = meta.get("preview") or meta.get("preview_image") or wallpaper_rel
+
+        item = {
+            "id": tdir.name,
+            "name": meta.get("name", tdir.name),
+            "dir": str(tdir),
+
+            "hypr": str(tdir / meta.get("hyprland_conf", "hyprland.conf")),
+            "waybar": str(tdir / meta.get("waybar_css", "waybar.css")),
+            "wallpaper": str(tdir / wallpaper_rel) if wallpaper_rel else "",
+            "preview": str(tdir / preview_rel) if preview_rel else "",
+
+            "gtk_theme": meta.get("gtk_theme", ""),
+            "gtk_icon_theme": meta.get("gtk_icon_theme", ""),
+            "gtk_cursor_theme": meta.get("gtk_cursor_theme", ""),
+            "gtk_font_name": meta.get("gtk_font_name", ""),
+            "adw_color_scheme": meta.get("adw_color_scheme", ""),
+
+            "ghostty_src": meta.get("ghostty_src", "ghostty"),
+            "ghostty_target": meta.get("ghostty_target", "config"),
+
+            "zen_profile_dir": meta.get("zen_profile_dir", ""),
+            "zen_userchrome": meta.get("zen_userchrome", ""),
+            "zen_usercontent": meta.get("zen_usercontent", ""),
+
+            # Optional shared templates rendered with "vars" (see render_theme)
+            "hypr_template": str(tdir / meta["hyprland_template"]) if meta.get("hyprland_template") else "",
+            "waybar_template": str(tdir / meta["waybar_template"]) if meta.get("waybar_template") else "",
+            "vars": meta.get("vars", {}),
+        }
+        return item
+    except Exception as e:
+        print(f"[theme] failed to parse {tj}: {e}")
+        return None
+
+
+def _load_theme_index():
+    """(signature, entries) from the compiled index, or (None, None)."""
+    try:
+        idx = json.loads(THEME_INDEX_FILE.read_text(encoding="utf-8"))
+    except Exception:
+        return None, None
+    if idx.get("version") != THEME_INDEX_VERSION or idx.get("root") != str(THEME_ROOT):
+        return None, None
+    return idx.get("signature"), idx.get("themes") or {}
+
+
+def _write_theme_index(sig: str, entries: dict):
+    data = json.dumps({
+        "version": THEME_INDEX_VERSION,
+        "root": str(THEME_ROOT),
+        "signature": sig,
+        "themes": entries,
+    }, separators=(",", ":"))
+    try:
+        _write_json_atomic(THEME_INDEX_FILE, data)
+    except Exception as e:
+        print(f"[index] failed to write {THEME_INDEX_FILE}: {e}")
+
+
+def refresh_themes():
+    """Bring the theme cache up to date, reparsing only changed theme.json files.
+
+    Returns (themes, delta) where delta = {"added", "removed", "changed"} lists
+    of theme ids since the previous refresh (or since the compiled index).
+    """
+    global _THEME_CACHE_SIG, _THEME_CACHE, _THEME_ENTRIES
+    with _THEME_LOCK:
+        delta = {"added": [], "removed": [], "changed": []}
+        stamps = _theme_stamps()
+        sig = _themes_signature(stamps)
+        if sig == _THEME_CACHE_SIG and _THEME_CACHE is not None:
+            return _THEME_CACHE, delta
+
+        index_sig = None
+        if _THEME_ENTRIES is None:
+            index_sig, _THEME_ENTRIES = _load_theme_index()
+            _THEME_ENTRIES = _THEME_ENTRIES or {}
+
+        entries = {}
+        for tid in sorted(stamps):
+            old = _THEME_ENTRIES.get(tid)
+            if old and old["stamp"] == stamps[tid]:
+                entries[tid] = old
+                continue
+            item = _parse_theme(THEME_ROOT / tid)
+            if item is None:
+                continue
+            entries[tid] = {"stamp": stamps[tid], "item": item}
+            delta["changed" if old else "added"].append(tid)
+        delta["removed"] = sorted(set(_THEME_ENTRIES) - set(entries))
+
+        if sig != index_sig and stamps:
+            _write_theme_index(sig, entries)
+        _THEME_ENTRIES = entries
+        _THEME_CACHE_SIG = sig
+        _THEME_CACHE = [e["item"] for e in entries.values()]
+        return _THEME_CACHE, delta
+
+
+def compile_themes() -> list:
+    """Refresh the index and warm the caches apply reads for every theme.
+
+    Fingerprints, palettes and scaled wallpapers stay in their own caches, keyed
+    by file stat or content; index entries are only revalidated when theme.json
+    changes, so copies of them there would go stale.
+    """
+    themes, _delta = refresh_themes()
+    for item in themes:
+        for k in ("hypr", "waybar", "wallpaper"):
+            if item[k] and os.path.isfile(item[k]):
+                file_checksum(Path(item[k]))
+        if item["wallpaper"]:
+            extract_palette(Path(item["wallpaper"]))
+    with _THEME_LOCK:
+        _write_theme_index(_THEME_CACHE_SIG, _THEME_ENTRIES)
+    save_fingerprints()
+    warm_wallpaper_cache(background=False)
     return themes
 
 
+def list_themes():
+    return refresh_themes()[0]
+
+
 def runtime_float_rule():
     rules = [
         f"windowrulev2 float, app-id:^(?:{APP_ID})$",
         f"windowrulev2 size 960 620, app-id:^(?:{APP_ID})$",
         f"windowrulev2 move 5% 7%, app-id:^(?:{APP_ID})$"
     ]
-    for r in rules:
-        sh(f"hyprctl keyword '{r}'", check=False)
+    hyprctl(*[f"keyword {r}" for r in rules])
+
+
+# ---------- templates ----------
+
+_PLACEHOLDER = None
+
+
+def _placeholder():
+    """Compiled {{ name }} pattern (re is only needed by templated themes)."""
+    global _PLACEHOLDER
+    if _PLACEHOLDER is None:
+        import re
+        _PLACEHOLDER = re.compile(r"\{\{\s*([\w.-]+)\s*\}\}")
+    return _PLACEHOLDER
+
+
+def _substitute(text: str, context: dict, where: str) -> str:
+    """Replace {{ name }} placeholders; unknown names are an error."""
+    def repl(m):
+        try:
+            return str(context[m.group(1)])
+        except KeyError:
+            raise RuntimeError(f"{where}: undefined template variable '{m.group(1)}'") from None
+    return _placeholder().sub(repl, text)
+
+
+def render_template(template: Path, context: dict, name: str) -> Path:
+    """Render template with context into the render cache; reused when nothing changed."""
+    digest = file_checksum(template)
+    if not digest:
+        raise RuntimeError(f"template not found: {template}")
+    text = template.read_text(encoding="utf-8")
+    # Key on the variables the template uses, so equal renders share one file
+    used = {n: context.get(n) for n in sorted(set(_placeholder().findall(text)))}
+    key = fast_hash(digest + json.dumps(used, sort_keys=True))[:24]
+    out = RENDER_DIR / f"{key}-{name}"
+    try:
+        os.utime(out)  # LRU mark for _trim_render_cache
+        return out
+    except OSError:
+        pass
+
+    text = _substitute(text, context, str(template))
+    RENDER_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = out.with_name(f".{out.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp.write_text(text, encoding="utf-8")
+    os.replace(tmp, out)
+    _trim_render_cache()
+    return out
+
+
+def _trim_render_cache():
+    try:
+        entries = sorted((e.stat().st_mtime, e.path) for e in os.scandir(RENDER_DIR) if not e.name.startswith("."))
+    except OSError:
+        return
+    for _mtime, path in entries[:-RENDER_KEEP]:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+def theme_templated(t: dict) -> bool:
+    return bool(t.get("hypr_template") or t.get("waybar_template"))
+
+
+def render_theme(t: dict, wallpaper: Path | None = None) -> dict:
+    """Copy of t whose "hypr"/"waybar" point at rendered templates.
+
+    Variables come from the theme's "vars" plus theme.id, theme.name and, when
+    anything refers to them, palette.<role> from the wallpaper's palette:
+    "#rrggbb" for CSS, and palette.<role>.hex ("rrggbb") for Hyprland's
+    rgb()/rgba(). Var values may themselves use placeholders. Identical renders map to the same
+    cached file, so placing it on a target that already matches is a no-op.
+    """
+    templates = {k: Path(t[f"{k}_template"]) for k in ("hypr", "waybar") if t.get(f"{k}_template")}
+    variables = t.get("vars") or {}
+    context = {"theme.id": t["id"], "theme.name": t.get("name", t["id"])}
+
+    if "palette." in json.dumps(variables) or any(
+            "palette." in p.read_text(encoding="utf-8") for p in templates.values() if p.is_file()):
+        if wallpaper is None and t.get("wallpaper"):
+            wallpaper = Path(t["wallpaper"])
+        palette = extract_palette(wallpaper) if wallpaper else None
+        for role, value in (palette or {}).items():
+            context[f"palette.{role}"] = value
+            context[f"palette.{role}.hex"] = value.lstrip("#")
+
+    for name, value in variables.items():
+        context[name] = _substitute(str(value), context, f"{t['id']} vars.{name}")
+
+    rendered = dict(t)
+    names = {"hypr": "hyprland.conf", "waybar": "waybar.css"}
+    for kind, template in templates.items():
+        rendered[kind] = str(render_template(template, context, names[kind]))
+    return rendered
+
+
+# ---------- generations ----------
+
+def generations_enabled() -> bool:
+    return bool(load_state().get("generations", False))
+
+
+def set_generations(enabled: bool):
+    update_state(generations=bool(enabled))
+
+
+def _generation_files(t: dict) -> dict:
+    """{generation-relative path: (source file, live path)} for a theme."""
+    theme_path = Path(t["dir"])
+    files = {"hypr/hyprland.conf": (Path(t["hypr"]), HYPR_CONF)}
+    if os.path.isfile(t["waybar"]):
+        files["waybar/theme.css"] = (Path(t["waybar"]), WAYBAR_THEME)
+
+    ghostty_src = theme_path / t.get("ghostty_src", "ghostty")
+    if ghostty_src.is_dir():
+        for root, _dirs, names in os.walk(ghostty_src):
+            for name in names:
+                rel = os.path.relpath(os.path.join(root, name), ghostty_src)
+                files[f"ghostty/{rel}"] = (Path(root) / name, GHOSTTY_DIR / rel)
+    elif ghostty_src.is_file():
+        target = t.get("ghostty_target", "config").strip("/") or "config"
+        files[f"ghostty/{target}"] = (ghostty_src, GHOSTTY_DIR / target)
+
+    if t.get("zen_profile_dir", ""):
+        chrome_dir = Path(os.path.expanduser(t["zen_profile_dir"])) / "chrome"
+        for rel, name in ((t.get("zen_userchrome", ""), "userChrome.css"),
+                          (t.get("zen_usercontent", ""), "userContent.css")):
+            if rel and (theme_path / rel).is_file():
+                files[f"zen/{name}"] = (theme_path / rel, chrome_dir / name)
+    return files
+
+
+def _generation_manifest(gen: Path) -> dict:
+    try:
+        return json.loads((gen / "manifest.json").read_text(encoding="utf-8"))
+    except Exception:
+        return {}
+
+
+def current_generation() -> Path | None:
+    try:
+        return GEN_ROOT / Path(os.readlink(GEN_CURRENT)).name
+    except OSError:
+        return None
+
+
+def materialize_generation(t: dict) -> Path:
+    """Hardlink a theme's files into its generation dir (reused if already built)."""
+    import shutil
+
+    files = _generation_files(t)
+    digests = {rel: file_checksum(src) for rel, (src, _live) in files.items()}
+    name = f"{t['id']}-{fast_hash(json.dumps(sorted(digests.items())))[:12]}"
+    gen = GEN_ROOT / name
+    if (gen / "manifest.json").exists():
+        return gen
+
+    tmp = GEN_ROOT / f".{name}.tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    for rel, (src, _live) in files.items():
+        dst = tmp / rel
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            if _is_store_object(os.stat(src), digests[rel]):
+                raise PermissionError("shared store object")
+            os.link(src, dst)
+        except OSError:
+            clone_file(src, dst)
+            os.chmod(dst, stat.S_IMODE(os.stat(dst).st_mode) | stat.S_IWUSR)
+    manifest = {
+        "theme": t["id"],
+        "files": digests,
+        "live": {rel: str(live) for rel, (_src, live) in files.items()},
+    }
+    (tmp / "manifest.json").write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+    os.replace(tmp, gen)
+    print(f"[gen] materialized {gen}")
+    return gen
+
+
+def _ensure_live_link(live: Path, rel: str) -> bool:
+    """Point a live config path at GEN_CURRENT/rel (once; later swaps don't touch it).
+
+    True if the link had to be (re)made, i.e. what's live there just changed.
+    """
+    target = GEN_CURRENT / rel
+    try:
+        if os.readlink(live) == str(target):
+            return False
+    except OSError:
+        pass
+    live.parent.mkdir(parents=True, exist_ok=True)
+    backup(live)
+    if live.is_symlink() or live.exists():
+        live.unlink()
+    os.symlink(target, live)
+    print(f"[gen] {live} ⟶ {target}")
+    return True
+
+
+def _drop_live_link(live: Path, rel: str) -> bool:
+    """Remove a live link to GEN_CURRENT/rel that the new generation has no file for.
+
+    Snapshotted first, so a rollback brings back what was there. True if removed.
+    """
+    try:
+        if os.readlink(live) != str(GEN_CURRENT / rel):
+            return False  # replaced by something else since: not ours to remove
+    except OSError:
+        return False
+    backup(live)
+    live.unlink()
+    print(f"[gen] removed {live} (not in this generation)")
+    return True
+
+
+def activate_generation(gen: Path) -> set:
+    """Make `gen` current with one atomic symlink rename.
+
+    Returns the targets whose files changed ({"hypr", "waybar", "ghostty", "zen"}).
+    """
+    prev = current_generation()
+    manifest = _generation_manifest(gen)
+    # An apply with generations off in between may have put plain files over the links
+    relinked = {rel for rel, live in manifest.get("live", {}).items() if _ensure_live_link(Path(live), rel)}
+    if prev == gen:
+        return {rel.split("/", 1)[0] for rel in relinked}
+    new_files = manifest.get("files", {})
+    old_manifest = _generation_manifest(prev) if prev else {}
+    old_files = old_manifest.get("files", {})
+
+    tmp = STATE_DIR / ".current.tmp"
+    try:
+        tmp.unlink()
+    except FileNotFoundError:
+        pass
+    os.symlink(os.path.relpath(gen, STATE_DIR), tmp)
+    os.replace(tmp, GEN_CURRENT)
+    if prev:
+        update_state(generation_previous=prev.name)
+    print(f"[gen] activated {gen.name}")
+    # Files only the previous generation had would now dangle at current/<rel>
+    new_live = set(manifest.get("live", {}).values())
+    for rel, live in old_manifest.get("live", {}).items():
+        if live not in new_live:
+            _drop_live_link(Path(live), rel)
+
+    changed = relinked | {rel for rel in set(new_files) | set(old_files)
+                          if new_files.get(rel) != old_files.get(rel)}
+    _prune_generations(keep={gen, prev})
+    return {rel.split("/", 1)[0] for rel in changed}
+
+
+def rollback_generation() -> set:
+    """Swap back to the previously active generation."""
+    prev = load_state().get("generation_previous", "")
+    if not prev or not (GEN_ROOT / prev).is_dir():
+        raise RuntimeError("No previous generation to roll back to.")
+    begin_snapshot(f"generation rollback to {prev}")
+    try:
+        changed = activate_generation(GEN_ROOT / prev)
+    finally:
+        end_snapshot()
+    _reload_generation_targets(changed)
+    theme_id = _generation_manifest(GEN_ROOT / prev).get("theme")
+    if theme_id:
+        update_state(last_theme=theme_id)
+    return changed
+
+
+def _reload_generation_targets(changed: set):
+    if "waybar" in changed:
+        waybar_reload()
+    if "ghostty" in changed:
+        ghostty_reload(GHOSTTY_CONFIG_DEFAULT)
+    if "hypr" in changed:
+        hypr_reload()
+
+
+def _prune_generations(keep: set):
+    import shutil
+
+    try:
+        gens = sorted((p for p in GEN_ROOT.iterdir() if p.is_dir() and not p.name.startswith(".")),
+                      key=lambda p: p.stat().st_mtime, reverse=True)
+    except OSError:
+        return
+    for old in gens[GEN_KEEP:]:
+        if old not in keep:
+            shutil.rmtree(old, ignore_errors=True)
+
+
+# ---------- task graph ----------
+
+def run_task_graph(tasks: dict, max_workers: int = 4, cancel: threading.Event | None = None,
+                   progress=None):
+    """Run {name: (fn, deps)} nodes as soon as their deps have finished.
+
+    Each fn gets the results dict so far. Deps that aren't in the graph count
+    as satisfied; nodes downstream of a failure are skipped. Once `cancel` is
+    set no new node starts. progress(name, finished, total) follows each node.
+    Returns (results, timings) with timings as {name: (start, end)} seconds.
+    """
+    from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+    results, timings = {}, {}
+    done, failed = set(), set()
+    pending = dict(tasks)
+    running = {}
+    t0 = time.perf_counter()
+
+    def run(name, fn):
+        start = time.perf_counter() - t0
+        try:
+            with span(name, cat="stage"):
+                return fn(results)
+        finally:
+            timings[name] = (start, time.perf_counter() - t0)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as ex:
+        while pending or running:
+            if cancel is not None and cancel.is_set() and pending:
+                print(f"[apply] cancelled, not starting: {', '.join(pending)}")
+                pending.clear()
+            for name, (fn, deps) in list(pending.items()):
+                deps = [d for d in deps if d in tasks]
+                if any(d in failed for d in deps):
+                    del pending[name]
+                    failed.add(name)
+                    print(f"[apply:{name}] skipped (dependency failed)")
+                elif all(d in done for d in deps):
+                    del pending[name]
+                    running[ex.submit(run, name, fn)] = name
+            if not running:
+                break  # only unsatisfiable nodes left (cycle)
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in finished:
+                name = running.pop(fut)
+                try:
+                    results[name] = fut.result()
+                    done.add(name)
+                except Exception as e:
+                    failed.add(name)
+                    print(f"[apply:{name}] {e}")
+                if progress is not None:
+                    progress(name, len(done) + len(failed), len(tasks))
+    for name in pending:
+        print(f"[apply:{name}] never ran (dependency cycle)")
+    return results, timings
+
+
+def critical_path(tasks: dict, timings: dict) -> list:
+    """Chain of nodes that ended last, following each node's latest-finishing dep."""
+    if not timings:
+        return []
+    node = max(timings, key=lambda n: timings[n][1])
+    path = [node]
+    while True:
+        deps = [d for d in tasks[node][1] if d in timings]
+        if not deps:
+            break
+        node = max(deps, key=lambda d: timings[d][1])
+        path.append(node)
+    return path[::-1]
+
+
+def _report_critical_path(tasks: dict, timings: dict):
+    path = critical_path(tasks, timings)
+    if not path:
+        return
+    steps = " → ".join(f"{n} {(timings[n][1] - timings[n][0]) * 1000:.1f}ms" for n in path)
+    print(f"[apply] critical path: {steps} (total {timings[path[-1]][1] * 1000:.1f}ms)")
+
+
+# ---------- applied-fingerprint ledger ----------
+# state["ledger"] = {target: [inputs fingerprint, destination stamp]} as of the last apply
+
+def _drift_stamp(paths, extra: str = "") -> str:
+    """Stat-only identity of a target's destinations (plus e.g. the Hyprland instance)."""
+    parts = [extra]
+    for p in paths:
+        try:
+            st = os.stat(p)
+            parts.append(f"{p}:{st.st_dev}:{st.st_ino}:{st.st_size}:{st.st_mtime_ns}")
+        except OSError:
+            parts.append(f"{p}:-")
+    return fast_hash("|".join(parts))
+
+
+def _ghostty_io(t: dict) -> tuple:
+    """(inputs, destinations) of a theme's ghostty target, for the ledger."""
+    theme_path = Path(t["dir"])
+    src = theme_path / t.get("ghostty_src", "ghostty")
+    if src.is_dir():
+        files = sorted(p for p in src.rglob("*") if p.is_file())
+        return ([str(src)] + [(str(p.relative_to(src)), file_checksum(p)) for p in files],
+                [GHOSTTY_DIR / p.relative_to(src) for p in files])
+    if src.is_file():
+        target = t.get("ghostty_target", "config").strip("/") or "config"
+        return [str(src), target, file_checksum(src)], [GHOSTTY_DIR / target]
+    legacy = theme_path / "ghostty"
+    return [str(legacy), file_checksum(legacy)], [GHOSTTY_CONFIG_DEFAULT]
+
+
+def _zen_io(t: dict) -> tuple:
+    theme_path = Path(t["dir"])
+    chrome_dir = Path(os.path.expanduser(t.get("zen_profile_dir", ""))) / "chrome"
+    inputs, dsts = [str(chrome_dir)], []
+    for rel, name in ((t.get("zen_userchrome", ""), "userChrome.css"),
+                      (t.get("zen_usercontent", ""), "userContent.css")):
+        if rel:
+            inputs.append((name, file_checksum(theme_path / rel)))
+            dsts.append(chrome_dir / name)
+    return inputs, dsts
 
 
 # ---------- apply theme (turbo, parallel) ----------
 
-def _apply_ghostty(t):
+def _apply_ghostty(t) -> tuple:
+    """Place the theme's Ghostty config; returns (changed, ok)."""
     theme_path = Path(t["dir"])
     ghostty_src = theme_path / t.get("ghostty_src", "ghostty")
     ghostty_target_name = t.get("ghostty_target", "config").strip("/") or "config"
     ghostty_dst_file = GHOSTTY_DIR / ghostty_target_name
-    changed = False
+    changed, ok = False, True
 
     if ghostty_src.exists():
         if ghostty_src.is_dir():
-            changed = copy_tree_fast(ghostty_src, GHOSTTY_DIR)
+            stats = sync_tree(ghostty_src, GHOSTTY_DIR)
+            changed = bool(stats["link"] or stats["copy"] or stats["pruned"])
+            ok = not (stats["missing"] or stats["error"])
             cfg_to_touch = ghostty_dst_file if ghostty_dst_file.exists() else GHOSTTY_CONFIG_DEFAULT
             if changed:
                 ghostty_reload(cfg_to_touch)
         else:
-            if link_or_copy_file(ghostty_src, ghostty_dst_file):
+            outcome = _link_or_copy(ghostty_src, ghostty_dst_file)
+            ok = outcome not in ("missing", "error")
+            if outcome in ("link", "copy"):
                 changed = True
                 ghostty_reload(ghostty_dst_file)
     else:
         legacy_file = theme_path / "ghostty"
         if legacy_file.exists() and legacy_file.is_file():
-            if link_or_copy_file(legacy_file, GHOSTTY_CONFIG_DEFAULT):
+            outcome = _link_or_copy(legacy_file, GHOSTTY_CONFIG_DEFAULT)
+            ok = outcome not in ("missing", "error")
+            if outcome in ("link", "copy"):
                 changed = True
                 ghostty_reload(GHOSTTY_CONFIG_DEFAULT)
-    return changed
+    return changed, ok
+
+
+# ---------- prestage (speculative, on hover/focus) ----------
 
+def _prestage_work(theme_id: str, cancel: threading.Event):
+    t = next((x for x in list_themes() if x["id"] == theme_id), None)
+    if t is None:
+        return
+    theme_path = Path(t["dir"])
+    wp = Path(t["wallpaper"]) if t.get("wallpaper") else None
+    if wp is not None and wp.is_file() and not cancel.is_set():
+        # On the visible path of apply: scaled copies for every output
+        for o in hypr_monitors():
+            if cancel.is_set():
+                return
+            scaled_wallpaper(wp, o["width"], o["height"])
 
-def apply_theme(theme_id: str):
+    sources = [Path(t["hypr"]), Path(t["waybar"])]
+    ghostty_src = theme_path / t.get("ghostty_src", "ghostty")
+    if ghostty_src.is_dir():
+        sources.extend(p for p in ghostty_src.rglob("*") if p.is_file())
+    else:
+        sources.append(ghostty_src)
+    for src in sources:
+        if cancel.is_set():
+            return
+        if src.is_file():
+            file_checksum(src)
+
+    if wp is not None and wp.is_file() and not cancel.is_set():
+        extract_palette(wp)
+    if theme_templated(t) and not cancel.is_set():
+        render_theme(t, wp)
+    save_fingerprints()
+
+
+def prestage(theme_id: str) -> threading.Event | None:
+    """Warm fingerprints, scaled wallpapers and the palette of a theme in the background.
+
+    Supersedes any prestage of another theme; returns the cancel event (None when
+    this theme is already being staged). apply_theme reuses everything through
+    the usual caches.
+    """
+    global _PRESTAGE
+    with _PRESTAGE_LOCK:
+        if _PRESTAGE is not None:
+            tid, cancel, th = _PRESTAGE
+            if th.is_alive():
+                if tid == theme_id:
+                    return None
+                cancel.set()
+        cancel = threading.Event()
+
+        def worker():
+            try:
+                _prestage_work(theme_id, cancel)
+            except Exception as e:
+                print(f"[prestage] {theme_id}: {e}")
+
+        th = threading.Thread(target=worker, name=f"prestage-{theme_id}", daemon=True)
+        _PRESTAGE = (theme_id, cancel, th)
+        th.start()
+        return cancel
+
+
+def cancel_prestage(keep: str = "") -> threading.Thread | None:
+    """Cancel the in-flight prestage unless it's for `keep`; returns that one's thread."""
+    with _PRESTAGE_LOCK:
+        if _PRESTAGE is None or not _PRESTAGE[2].is_alive():
+            return None
+        tid, cancel, th = _PRESTAGE
+        if tid == keep:
+            return th
+        cancel.set()
+        return None
+
+
+class ApplyCancelled(RuntimeError):
+    """An apply was superseded by a newer request before it finished."""
+
+    def __init__(self, message: str, theme_id: str = ""):
+        super().__init__(message)
+        self.theme_id = theme_id
+
+
+def apply_theme(theme_id: str, cancel: threading.Event | None = None, progress=None,
+                force: bool = False) -> dict:
+    """Apply a theme; returns the trace summary (per-stage ms, file outcomes, bytes).
+
+    Targets whose inputs and destinations match the ledger are skipped unless
+    `force`. With `cancel`, stops between stages once it's set and raises
+    ApplyCancelled; progress(stage, finished, total) is called as stages complete.
+    """
+    begin_trace()
+    begin_snapshot(f"apply {theme_id}")
+    try:
+        _apply_theme(theme_id, cancel, progress, force)
+    finally:
+        end_snapshot()
+        summary = end_trace(theme_id)
+    print(f"[apply] {theme_id} in {summary['total_ms']:.1f}ms"
+          + (f", slowest: {summary['slowest']} {summary['stages'][summary['slowest']]:.1f}ms"
+             if summary["slowest"] else ""))
+    return summary
+
+
+def _apply_theme(theme_id: str, cancel: threading.Event | None = None, progress=None, force: bool = False):
+    # Free the CPU from staging other themes; a prestage of this one keeps going
+    staging = cancel_prestage(keep=theme_id)
     ensure_dirs()
     state = load_state()
     get_turbo()  # ensure _TURBO reflects persisted pref
@@ -487,63 +2672,389 @@ def apply_theme(theme_id: str):
     t = themes[theme_id]
     theme_path = Path(t["dir"])
 
-    hypr_src = theme_path / Path(t["hypr"])
     waybar_src = theme_path / Path(t["waybar"])
-
-    results = {}
-
-    with ThreadPoolExecutor(max_workers=4) as ex:
-        futs = {
-            "hypr": ex.submit(link_or_copy_file, hypr_src, HYPR_CONF),
-            "waybar": ex.submit(link_or_copy_file, waybar_src, WAYBAR_THEME) if waybar_src.exists() else None,
-            "ghostty": ex.submit(_apply_ghostty, t),
-            "zen": ex.submit(
-                apply_zen_userstyles, theme_path,
+    owed = dict(_OWED_RELOADS)
+    _OWED_RELOADS.clear()
+    if "hypr" in owed:
+        old_hypr = owed["hypr"]  # a cancelled apply replaced the file but never reloaded
+    else:
+        try:
+            old_hypr = HYPR_CONF.read_text(encoding="utf-8")  # for a keyword-level reload
+        except (OSError, UnicodeDecodeError):
+            old_hypr = None
+    cursor = t.get("gtk_cursor_theme", "")
+    wp_path = Path(t.get("wallpaper", "")).expanduser()
+    has_wallpaper = bool(t.get("wallpaper")) and wp_path.is_file()
+
+    # Skip targets already applied from the same inputs whose destinations haven't drifted.
+    # Runtime-only targets (cursor, wallpaper) are tied to the Hyprland instance instead.
+    ledger = {} if force else dict(state.get("ledger") or {})
+    recorded = {}
+    session = os.environ.get("HYPRLAND_INSTANCE_SIGNATURE", "")
+
+    def guarded(target, io, fn, skipped=False, extra=""):
+        """Node running fn(r) -> (result, ok) unless io(r) -> (inputs, destinations) matches the ledger.
+
+        Only an ok run is recorded, so a failed step is tried again next apply.
+        """
+        def node(r):
+            inputs, paths = io(r)
+            fp = fast_hash(json.dumps(inputs, sort_keys=True, default=str))
+            if ledger.get(target) == [fp, _drift_stamp(paths, extra)]:
+                print(f"[ledger] {target} up to date")
+                return skipped
+            result, ok = fn(r)
+            if ok:
+                recorded[target] = [fp, _drift_stamp(paths, extra)]
+            else:
+                print(f"[ledger] {target} failed, not recorded")
+            return result
+        return node
+
+    def place(src_file, dst):
+        """(changed, ok) of placing one file."""
+        outcome = _link_or_copy(Path(src_file), dst)
+        return outcome in ("link", "copy"), outcome not in ("missing", "error")
+
+    def settings(_r):
+        changed = set_gsettings(*gtk)
+        return changed, changed is not None  # None: fell back to gsettings, unverified
+
+    def apply_palette(_r):
+        # Async when turbo: nothing downstream waits on the app's CSS
+        if _TURBO:
+            update_palette_async(wp_path, wait_for=staging)
+            return None, True
+        if staging is not None:
+            staging.join()
+        palette = extract_palette(wp_path)
+        write_runtime_css_vars(palette)
+        return None, palette is not None
+
+    def render(_r):
+        if staging is not None:
+            staging.join()  # it renders this theme too
+        return render_theme(t, wp_path if t.get("wallpaper") else None)
+
+    # Templated themes render their configs first; the file nodes then place the
+    # rendered outputs, which skip (and skip the reload) when the bytes match
+    if theme_templated(t):
+        src_deps = ["render"]
+    else:
+        src_deps = []
+
+    def src(r):
+        return r.get("render") or t
+
+    def changed(kind, r):
+        """kind's files changed here, or an earlier cancelled apply still owes its reload."""
+        if kind in owed:
+            return True
+        if "activate" in r:
+            return kind in r["activate"]
+        return bool(r.get(kind))
+
+    # name -> (fn(results), deps); each follow-up fires once its own deps finish
+    gtk = [t.get("gtk_theme", ""), t.get("gtk_icon_theme", ""), cursor,
+           t.get("gtk_font_name", ""), t.get("adw_color_scheme", "")]
+    tasks = {
+        # Any dconf write touches its user db, which makes a cheap drift check
+        "settings": (guarded("settings", lambda r: (gtk, [CONFIG / "dconf" / "user"]), settings,
+                             skipped=[]), []),
+    }
+    if src_deps:
+        tasks["render"] = (render, [])
+    if generations_enabled():
+        # All config files switch at once; reloads follow what actually changed
+        tasks["activate"] = (lambda r: activate_generation(materialize_generation(src(r))), src_deps)
+        tasks["hypr_reload"] = (lambda r: changed("hypr", r) and hypr_reload(old_hypr), ["activate"])
+        tasks["waybar_reload"] = (lambda r: changed("waybar", r) and waybar_reload(), ["activate"])
+        tasks["ghostty_reload"] = (lambda r: changed("ghostty", r)
+                                   and ghostty_reload(GHOSTTY_CONFIG_DEFAULT), ["activate"])
+    else:
+        tasks["hypr"] = (guarded("hypr", lambda r: (file_checksum(Path(src(r)["hypr"])), [HYPR_CONF]),
+                                 lambda r: place(src(r)["hypr"], HYPR_CONF)), src_deps)
+        tasks["hypr_reload"] = (lambda r: changed("hypr", r) and hypr_reload(old_hypr), ["hypr"])
+        tasks["ghostty"] = (guarded("ghostty", lambda r: _ghostty_io(t), lambda r: _apply_ghostty(t)), [])
+        if t.get("waybar_template") or waybar_src.exists():
+            tasks["waybar"] = (guarded("waybar",
+                                       lambda r: (file_checksum(Path(src(r)["waybar"])), [WAYBAR_THEME]),
+                                       lambda r: place(src(r)["waybar"], WAYBAR_THEME)),
+                               src_deps)
+            tasks["waybar_reload"] = (lambda r: changed("waybar", r) and waybar_reload(), ["waybar"])
+        if t.get("zen_profile_dir", ""):
+            tasks["zen"] = (guarded("zen", lambda r: _zen_io(t), lambda r: (None, apply_zen_userstyles(
+                theme_path,
                 Path(os.path.expanduser(t.get("zen_profile_dir", ""))),
                 t.get("zen_userchrome", ""), t.get("zen_usercontent", "")
-            ) if t.get("zen_profile_dir", "") else None,
-            "settings": ex.submit(
-                set_gsettings,
-                t.get("gtk_theme", ""),
-                t.get("gtk_icon_theme", ""),
-                t.get("gtk_cursor_theme", ""),
-                t.get("gtk_font_name", ""),
-                t.get("adw_color_scheme", ""),
-            ),
-        }
-        for k, f in futs.items():
-            if f is None:
-                continue
+            ))), [])
+    if cursor:
+        tasks["cursor"] = (guarded("cursor", lambda r: ([cursor, 24], []),
+                                   lambda r: (None, set_wayland_cursor(cursor, 24)), extra=session),
+                           ["settings"])
+    if has_wallpaper:
+        tasks["wallpaper"] = (guarded("wallpaper", lambda r: (file_checksum(wp_path), []),
+                                      lambda r: (lambda ok: (ok, ok))(set_wallpaper(wp_path)),
+                                      extra=session), [])
+        tasks["palette"] = (guarded("palette",
+                                    lambda r: ([file_checksum(wp_path), PALETTE_VERSION], [RUNTIME_CSS_FILE]),
+                                    apply_palette),
+                            src_deps)  # render may have extracted it already
+
+    results, timings = run_task_graph(tasks, cancel=cancel, progress=progress)
+    _report_critical_path(tasks, timings)
+
+    if recorded:
+        update_state(ledger={**(state.get("ledger") or {}), **recorded})
+
+    if cancel is not None and cancel.is_set() and len(results) < len(tasks):
+        # Files placed by this run keep the reloads it skipped owed to the next apply
+        for kind in ("hypr", "waybar", "ghostty"):
+            if f"{kind}_reload" in tasks and f"{kind}_reload" not in results and changed(kind, results):
+                _OWED_RELOADS.setdefault(kind, old_hypr if kind == "hypr" else None)
+        save_fingerprints()
+        raise ApplyCancelled(f"apply of '{theme_id}' superseded", theme_id)
+
+    # Save state (coalesced with any other writes in this burst)
+    changes = {"last_theme": theme_id, "turbo": _TURBO}
+    if results.get("wallpaper") and "wallpaper" in recorded:
+        changes["last_wallpaper"] = str(wp_path)
+    update_state(**changes)
+    save_fingerprints()
+
+
+def current_theme() -> str:
+    return load_state().get("last_theme", "")
+
+
+def queued_theme() -> str:
+    """The theme the apply queue will end on: the pending job's, the running one's, else the current."""
+    with _QUEUE_COND:
+        for job in (_QUEUE_PENDING, _QUEUE_RUNNING):
+            if job is not None and not job["cancel"].is_set():
+                return job["id"]
+    return current_theme()
+
+
+def next_theme_id(step: int) -> str:
+    """Id of the theme `step` places after the one the queue ends on (wrapping)."""
+    ids = [t["id"] for t in list_themes()]
+    if not ids:
+        raise RuntimeError("No themes found.")
+    cur = queued_theme()
+    if cur in ids:
+        return ids[(ids.index(cur) + step) % len(ids)]
+    return ids[0] if step > 0 else ids[-1]
+
+
+def cycle_theme(step: int) -> str:
+    """Apply the theme `step` places after the current one (wrapping); returns its id."""
+    nxt = next_theme_id(step)
+    apply_theme(nxt)
+    return nxt
+
+
+# ---------- apply queue (coalescing, cancellation, progress) ----------
+
+def request_apply(theme_id: str, progress=None, done=None):
+    """Queue an apply without waiting for it.
+
+    A newer request replaces a pending one and cancels a running one at its
+    next stage boundary, so only the last requested theme pays for reloads.
+    Asking again for the theme that's running or pending just waits for it. Callbacks run
+    on the queue's worker thread: progress(theme_id, stage, finished, total)
+    and done(theme_id, summary, error), error being ApplyCancelled for a
+    superseded request.
+    """
+    global _QUEUE_PENDING, _QUEUE_WORKER
+    superseded = None
+    with _QUEUE_COND:
+        running = _QUEUE_RUNNING
+        if running is not None and running["id"] == theme_id and not running["cancel"].is_set():
+            superseded, _QUEUE_PENDING = _QUEUE_PENDING, None
+            running["progress"].extend([progress] if progress else [])
+            running["done"].extend([done] if done else [])
+        elif _QUEUE_PENDING is not None and _QUEUE_PENDING["id"] == theme_id:
+            _QUEUE_PENDING["progress"].extend([progress] if progress else [])
+            _QUEUE_PENDING["done"].extend([done] if done else [])
+        else:
+            superseded = _QUEUE_PENDING
+            _QUEUE_PENDING = {"id": theme_id, "cancel": threading.Event(),
+                              "progress": [progress] if progress else [], "done": [done] if done else []}
+            if running is not None:
+                running["cancel"].set()
+            if _QUEUE_WORKER is None:
+                _QUEUE_WORKER = threading.Thread(target=_apply_worker, name="apply-queue", daemon=True)
+                _QUEUE_WORKER.start()
+            _QUEUE_COND.notify()
+    if superseded is not None:
+        err = ApplyCancelled(f"apply of '{superseded['id']}' superseded by '{theme_id}'", superseded["id"])
+        for cb in superseded["done"]:
+            cb(superseded["id"], None, err)
+
+
+def _apply_worker():
+    global _QUEUE_PENDING, _QUEUE_RUNNING
+    while True:
+        with _QUEUE_COND:
+            while _QUEUE_PENDING is None:
+                _QUEUE_COND.wait()
+            job, _QUEUE_PENDING = _QUEUE_PENDING, None
+            _QUEUE_RUNNING = job
+
+        def progress(stage, finished, total, job=job):
+            for cb in list(job["progress"]):
+                try:
+                    cb(job["id"], stage, finished, total)
+                except Exception as e:
+                    print(f"[queue] progress callback failed: {e}")
+
+        summary, err = None, None
+        try:
+            summary = apply_theme(job["id"], cancel=job["cancel"], progress=progress)
+        except Exception as e:
+            err = e
+        with _QUEUE_COND:
+            _QUEUE_RUNNING = None
+        for cb in job["done"]:
             try:
-                results[k] = f.result()
+                cb(job["id"], summary, err)
             except Exception as e:
-                print(f"[apply:{k}] {e}")
+                print(f"[queue] done callback failed: {e}")
 
-    # Cursor after settings (non-blocking)
-    cursor = t.get("gtk_cursor_theme", "")
-    if cursor:
-        set_wayland_cursor(cursor, 24)
 
-    # Wallpaper + palette (palette async if turbo)
-    wp_path = Path(t.get("wallpaper", "")).expanduser()
-    last_wp = state.get("last_wallpaper", "")
-    if str(wp_path) and str(wp_path) != last_wp and wp_path.exists():
-        set_wallpaper(wp_path)
-        if _TURBO:
-            update_palette_async(wp_path)
-        else:
-            pal = extract_palette(wp_path)
-            write_runtime_css_vars(pal)
-        state["last_wallpaper"] = str(wp_path)
+def request_step(step: int, progress=None, done=None) -> str:
+    """request_apply() the theme `step` places after the one the queue ends on; returns its id.
 
-    # Waybar signal and Hypr reload only if needed
-    if results.get("waybar"):
-        waybar_reload()
-    if results.get("hypr"):
-        hypr_reload()
+    Resolving against the queued job rather than last_theme, under the queue's
+    (re-entrant) lock, makes every press of a quick next/next/next count.
+    """
+    with _QUEUE_COND:
+        theme_id = next_theme_id(step)
+        request_apply(theme_id, progress=progress, done=done)
+    return theme_id
+
+
+def apply_theme_queued(theme_id: str, progress=None, step: int = 0) -> tuple:
+    """request_apply() and wait; returns (theme id, summary) or raises (ApplyCancelled if superseded).
 
-    # Save state
-    state["last_theme"] = theme_id
-    state["turbo"] = _TURBO
-    save_state(state)
+    With a non-zero step, theme_id is ignored and the theme comes from request_step().
+    """
+    finished = threading.Event()
+    outcome = {}
 
+    def done(_tid, summary, err):
+        outcome.update(summary=summary, err=err)
+        finished.set()
+
+    if step:
+        theme_id = request_step(step, progress=progress, done=done)
+    else:
+        request_apply(theme_id, progress=progress, done=done)
+    finished.wait()
+    if outcome["err"] is not None:
+        raise outcome["err"]
+    return theme_id, outcome["summary"]
+
+
+def warm_up():
+    """Load the caches a long-running process wants ready before its first apply."""
+    _fp_index()
+    _palette_cache()
+    try:
+        _interface_settings()
+    except Exception as e:
+        print(f"[gio] settings unavailable: {e}")
+    warm_wallpaper_cache(background=True)
+
+
+# ---------- CLI ----------
+
+def main(argv=None):
+    import argparse
+
+    ap = argparse.ArgumentParser(prog="engine.py", description="hyprtheme engine")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("apply", help="apply a theme by id")
+    p.add_argument("theme_id")
+    p.add_argument("--trace", metavar="FILE", help="write a Chrome trace of this apply to FILE")
+    p.add_argument("--force", action="store_true", help="re-apply every target, ignoring the ledger")
+    sub.add_parser("snapshots", help="list the pre-apply snapshots, newest first")
+    p = sub.add_parser("rollback", help="restore files to before an apply (default: the latest)")
+    p.add_argument("snapshot_id", nargs="?", default="")
+    sub.add_parser("restore", help="re-apply the current theme (login); up-to-date targets are skipped")
+    sub.add_parser("next", help="apply the next theme")
+    sub.add_parser("prev", help="apply the previous theme")
+    sub.add_parser("status", help="print the current theme")
+    sub.add_parser("current", help="print the current theme (alias of status)")
+    sub.add_parser("list", help="list installed themes")
+    sub.add_parser("compile", help="rebuild the theme index")
+    sub.add_parser("daemon", help="run the resident engine on a UNIX socket")
+    p = sub.add_parser("import", help="import a .tar/.zip theme pack through the asset store")
+    p.add_argument("pack")
+    p.add_argument("--force", action="store_true", help="replace themes that already exist")
+    p = sub.add_parser("store", help="content-addressed asset store (deduplicated theme files are "
+                                     "read-only and copied, not hardlinked, on apply)")
+    p.add_argument("action", choices=("status", "dedupe", "gc"))
+    p = sub.add_parser("hyprdiff", help="show how switching hyprland.conf OLD -> NEW would be applied")
+    p.add_argument("old")
+    p.add_argument("new")
+    p = sub.add_parser("generations", help="symlink-swap activation mode")
+    p.add_argument("action", choices=("on", "off", "status", "rollback"))
+    args = ap.parse_args(argv)
+
+    if args.cmd == "apply":
+        if args.trace:
+            os.environ["HYPRTHEME_TRACE"] = args.trace
+        apply_theme(args.theme_id, force=args.force)
+    elif args.cmd == "snapshots":
+        for snap in list_snapshots():
+            when = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(snap["time"]))
+            print(f"{snap['id']}  {when}  {len(snap['files']):3d} files  {snap['label']}")
+    elif args.cmd == "rollback":
+        restored = rollback_snapshot(args.snapshot_id)
+        print(f"[rollback] {len(restored)} file(s) restored")
+    elif args.cmd == "restore":
+        cur = current_theme()
+        if cur:
+            apply_theme(cur)
+    elif args.cmd in ("next", "prev"):
+        print(cycle_theme(1 if args.cmd == "next" else -1))
+    elif args.cmd in ("status", "current"):
+        print(current_theme())
+    elif args.cmd == "list":
+        cur = current_theme()
+        for t in list_themes():
+            print(f"{'*' if t['id'] == cur else ' '} {t['id']}\t{t['name']}")
+    elif args.cmd == "compile":
+        themes = compile_themes()
+        print(f"[index] {len(themes)} themes → {THEME_INDEX_FILE}")
+    elif args.cmd == "import":
+        if not import_theme_pack(Path(args.pack), force=args.force):
+            return 1
+    elif args.cmd == "store":
+        if args.action == "dedupe":
+            print(json.dumps(store_ingest(THEME_ROOT)))
+        elif args.action == "gc":
+            print(json.dumps(store_gc()))
+        else:
+            print(json.dumps(store_status()))
+    elif args.cmd == "generations":
+        if args.action in ("on", "off"):
+            set_generations(args.action == "on")
+        elif args.action == "rollback":
+            rollback_generation()
+        gen = current_generation()
+        print(f"generations: {'on' if generations_enabled() else 'off'}, current: {gen.name if gen else '-'}")
+    elif args.cmd == "hyprdiff":
+        plan = hypr_keyword_plan(Path(args.old).read_text(encoding="utf-8"),
+                                 Path(args.new).read_text(encoding="utf-8"))
+        print("full reload" if plan is None else "\n".join(plan) or "no effective changes")
+    elif args.cmd == "daemon":
+        import daemon
+        return daemon.serve(sys.modules[__name__])
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
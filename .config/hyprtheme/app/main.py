@@ -10,10 +10,12 @@ import gi
 
 gi.require_version("Gtk", "4.0")
 gi.require_version("Adw", "1")
-from engine import THEME_ROOT, apply_theme, get_turbo
+import daemon
+from engine import THEME_ROOT, ApplyCancelled, get_turbo, prestage, request_apply
 from gi.repository import Adw, Gio, GLib, Gtk
 
 APP_TITLE = "HyprTheme"
+PRESTAGE_DELAY_MS = 150  # hover this long before staging, so sweeping the grid stays cheap
 
 # ---- ThemeCard ----
 
@@ -80,9 +82,9 @@ class ThemeCard(Gtk.Button):
         spinner.set_spinning(True)
         self.apply_overlay.append(spinner)
 
-        label = Gtk.Label(label="Applying…")
-        label.add_css_class("title")
-        self.apply_overlay.append(label)
+        self.apply_label = Gtk.Label(label="Applying…")
+        self.apply_label.add_css_class("title")
+        self.apply_overlay.append(self.apply_label)
 
         self.apply_overlay.set_visible(False)
         overlay.add_overlay(self.apply_overlay)
@@ -90,32 +92,97 @@ class ThemeCard(Gtk.Button):
         self.set_child(overlay)
         self.connect("clicked", self.on_apply_clicked)
 
-    def set_busy(self, busy: bool):
+        # Speculatively stage the theme while the pointer or keyboard focus rests on it
+        self._prestage_id = 0
+        motion = Gtk.EventControllerMotion()
+        motion.connect("enter", lambda *_: self.schedule_prestage())
+        motion.connect("leave", lambda *_: self.cancel_prestage())
+        self.add_controller(motion)
+        focus = Gtk.EventControllerFocus()
+        focus.connect("enter", lambda *_: self.schedule_prestage())
+        focus.connect("leave", lambda *_: self.cancel_prestage())
+        self.add_controller(focus)
+
+    def schedule_prestage(self):
+        if self._prestage_id or self.busy:
+            return
+        theme_id = self.theme["id"]
+
+        def worker():
+            # The daemon applies, so it's the one that should warm its caches
+            try:
+                if daemon.request("prestage", theme_id, timeout=0.5) is None:
+                    prestage(theme_id)
+            except Exception as e:
+                print(f"[prestage] {theme_id}: {e}")
+
+        def fire():
+            self._prestage_id = 0
+            # Off the main loop: a busy daemon would otherwise stall the UI for the timeout
+            threading.Thread(target=worker, daemon=True).start()
+            return False
+        self._prestage_id = GLib.timeout_add(PRESTAGE_DELAY_MS, fire)
+
+    def cancel_prestage(self):
+        if self._prestage_id:
+            GLib.source_remove(self._prestage_id)
+            self._prestage_id = 0
+
+    def set_busy(self, busy: bool, stage: str = ""):
         self.busy = busy
         self.set_sensitive(not busy)
         self.apply_overlay.set_visible(busy)
+        self.apply_label.set_label(f"Applying… {stage}" if stage else "Applying…")
 
     def on_apply_clicked(self, _btn):
         if self.busy:
             return
         self.set_busy(True)
         self.appwin.toast(f"Applying {self.theme.get('name', self.theme['id'])}…")
+        theme_id = self.theme["id"]
+
+        # Both paths deliver on the main loop; a newer click elsewhere supersedes this one
+        def progress(stage, finished, total):
+            if self.busy:
+                self.set_busy(True, f"{finished}/{total} {stage}")
+            return False
+
+        def done(summary, err):
+            self.set_busy(False)
+            if isinstance(err, ApplyCancelled) or err == "cancelled":
+                return False  # the newer apply reports for itself
+            if err:
+                self.appwin.toast(f"Failed: {err}")
+            else:
+                msg = f"Applied {self.theme.get('name', theme_id)}"
+                if summary.get("total_ms"):
+                    msg += f" in {summary['total_ms']:.0f} ms"
+                    slowest = summary.get("slowest")
+                    if slowest:
+                        msg += f" (slowest: {slowest} {summary['stages'][slowest]:.0f} ms)"
+                self.appwin.toast(msg)
+            return False
 
         def worker():
-            err = None
+            # Prefer the resident daemon (warm caches); queue in-process otherwise
             try:
-                apply_theme(self.theme["id"])
+                reply = daemon.request("apply", theme_id, on_event=lambda ev: GLib.idle_add(
+                    progress, ev["stage"], ev["done"], ev["total"]))
             except Exception as e:
-                err = e
-
-            def done():
-                self.set_busy(False)
-                if err:
-                    self.appwin.toast(f"Failed: {err}")
-                else:
-                    self.appwin.toast(f"Applied {self.theme.get('name', self.theme['id'])}")
-                return False
-            GLib.idle_add(done)
+                GLib.idle_add(done, {}, e)
+                return
+            if reply is None:
+                request_apply(
+                    theme_id,
+                    progress=lambda _tid, stage, finished, total: GLib.idle_add(progress, stage, finished, total),
+                    done=lambda _tid, summary, err: GLib.idle_add(done, summary or {}, err),
+                )
+            elif reply.get("cancelled"):
+                GLib.idle_add(done, {}, "cancelled")
+            elif not reply.get("ok"):
+                GLib.idle_add(done, {}, reply.get("error", "daemon error"))
+            else:
+                GLib.idle_add(done, reply.get("summary") or {}, None)
 
         threading.Thread(target=worker, daemon=True).start()
 